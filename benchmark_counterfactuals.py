@@ -0,0 +1,251 @@
+from owlapy.model import OWLObjectProperty, IRI, OWLObjectSomeValuesFrom, \
+    OWLObjectUnionOf, OWLObjectIntersectionOf, OWLClass, \
+    OWLObjectComplementOf, OWLObjectAllValuesFrom, OWLNamedIndividual
+from concurrent.futures import ProcessPoolExecutor
+import counterfactual_candidate_generator_ALC as generator_module
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import types
+import owlready2
+
+'''
+Benchmark harness for the CounterfactualCandidateGenerator.
+
+Synthetic ALCH ontologies (configurable ABox size, role fan-out and TBox
+depth) and random ALCH concepts (configurable nesting and numbers of
+disjuncts/conjuncts) are generated, generate_candidates is run on them and
+wall time, peak RSS growth, Pellet checks, ontology loads and the phase
+timings and counters of the generator's Instrumentation are written as
+JSON, so runs can be compared.
+
+Example:
+    python benchmark_counterfactuals.py --individuals 1000 --fan-out 3 \
+        --tbox-depth 3 --nesting 2 --disjuncts 4 --conjuncts 3 \
+        --runs 5 --output bench.json
+'''
+
+NAMESPACE = 'http://example.com/benchmark#'
+
+
+def make_ontology(file_name, individuals: int = 1000, roles: int = 3,
+                  fan_out: int = 3, tbox_depth: int = 3,
+                  classes_per_level: int = 4, seed: int = 0):
+    '''
+    Writes a synthetic ALCH ontology as RDF/XML.
+    Args:
+        file_name: the .owl file to write
+        individuals: number of individuals in the ABox
+        roles: number of roles, every role gets one sub role
+        fan_out: number of role assertions per individual
+        tbox_depth: number of levels of the class hierarchy
+        classes_per_level: number of classes on each level
+        seed: seed of the random generator
+    Returns the names of the classes, roles and individuals.
+    '''
+    rng = random.Random(seed)
+    world = owlready2.World()
+    onto = world.get_ontology(NAMESPACE)
+    with onto:
+        class_list = []
+        parents = [owlready2.Thing]
+        for level in range(tbox_depth):
+            level_classes = [types.new_class(f'C{level}_{k}',
+                                             (rng.choice(parents),))
+                             for k in range(classes_per_level)]
+            class_list.extend(level_classes)
+            parents = level_classes
+        role_list = []
+        for k in range(roles):
+            role = types.new_class(f'r{k}', (owlready2.ObjectProperty,))
+            role_list.append(role)
+            role_list.append(types.new_class(f'r{k}_sub', (role,)))
+        individual_list = [rng.choice(class_list)(f'i{n}')
+                           for n in range(individuals)]
+        for an_individual in individual_list:
+            for _ in range(fan_out):
+                role = rng.choice(role_list)
+                getattr(an_individual, role.name).append(
+                    rng.choice(individual_list))
+    onto.save(file=file_name, format='rdfxml')
+    return ([a_class.name for a_class in class_list],
+            [role.name for role in role_list],
+            [an_individual.name for an_individual in individual_list])
+
+
+def _random_literal(rng, classes, roles, nesting):
+    kinds = ['class', 'complement']
+    if nesting > 0:
+        kinds.extend(['some', 'all'])
+    kind = rng.choice(kinds)
+    if kind == 'class':
+        return OWLClass(IRI(NAMESPACE, rng.choice(classes)))
+    if kind == 'complement':
+        return OWLObjectComplementOf(OWLClass(IRI(NAMESPACE,
+                                                  rng.choice(classes))))
+    role = OWLObjectProperty(IRI(NAMESPACE, rng.choice(roles)))
+    filler = _random_literal(rng, classes, roles, nesting-1)
+    if kind == 'some':
+        return OWLObjectSomeValuesFrom(role, filler)
+    return OWLObjectAllValuesFrom(role, filler)
+
+
+def random_concept(rng, classes, roles, disjuncts: int = 3,
+                   conjuncts: int = 3, nesting: int = 2):
+    '''
+    Creates a random ALCH concept as union of intersections of literals.
+    Args:
+        rng: a random.Random
+        classes: names of the classes to use
+        roles: names of the roles to use
+        disjuncts: number of operands of the union
+        conjuncts: number of operands of each intersection
+        nesting: maximal nesting depth of the restrictions
+    '''
+    terms = []
+    for _ in range(disjuncts):
+        literals = [_random_literal(rng, classes, roles, nesting)
+                    for _ in range(conjuncts)]
+        terms.append(OWLObjectIntersectionOf(literals)
+                     if len(literals) > 1 else literals[0])
+    return OWLObjectUnionOf(terms) if len(terms) > 1 else terms[0]
+
+
+class _Counter:
+    '''
+    Wraps a class of the generator module and counts its constructions.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self._original = getattr(generator_module, name)
+
+    def __call__(self, *args, **kwargs):
+        self.count = self.count+1
+        return self._original(*args, **kwargs)
+
+    def install(self):
+        setattr(generator_module, self.name, self)
+
+    def uninstall(self):
+        setattr(generator_module, self.name, self._original)
+
+
+def _run(file_name, concept, individual, goal_is_hold, workers):
+    '''
+    One benchmark run, executed in a forked process of its own.
+    A forked process starts with the RSS of its parent (e.g. the world of
+    make_ontology) as peak RSS, so the peak RSS growth over the start of
+    the process is reported.
+    '''
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    loads = _Counter('KnowledgeBase')
+    loads.install()
+    try:
+        start = time.perf_counter()
+        generator = generator_module.CounterfactualCandidateGenerator(
+            concept, file_name, OWLNamedIndividual(IRI(NAMESPACE, individual)),
+            NAMESPACE, goal_is_hold=goal_is_hold, saving=False)
+        generator.generate_candidates(workers=workers)
+        wall_time = time.perf_counter()-start
+    finally:
+        loads.uninstall()
+    return {'wall_time': wall_time,
+            'peak_rss_growth_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss-start_rss,
+            # instance checks that really ran Pellet, not served by cache
+            'pellet_checks': generator._reasoner._checks,
+            'ontology_loads': loads.count,
+            'candidates': len(generator.candidate_dict),
+            'instrumentation': generator.instrumentation.report()}
+
+
+# arguments of _run for the next forked benchmark process
+_next_run = None
+
+
+def _run_next():
+    return _run(*_next_run)
+
+
+def run_benchmark(individuals: int = 1000, roles: int = 3, fan_out: int = 3,
+                  tbox_depth: int = 3, classes_per_level: int = 4,
+                  disjuncts: int = 3, conjuncts: int = 3, nesting: int = 2,
+                  goal_is_hold: bool = True, runs: int = 3, workers: int = 1,
+                  seed: int = 0):
+    '''
+    Generates one ontology and runs generate_candidates for a new random
+    concept and individual per run.
+    Returns the configuration and the measurements of every run.
+    '''
+    config = dict(individuals=individuals, roles=roles, fan_out=fan_out,
+                  tbox_depth=tbox_depth, classes_per_level=classes_per_level,
+                  disjuncts=disjuncts, conjuncts=conjuncts, nesting=nesting,
+                  goal_is_hold=goal_is_hold, runs=runs, workers=workers,
+                  seed=seed)
+    rng = random.Random(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, 'benchmark.owl')
+        classes, role_names, individual_names = make_ontology(
+            file_name, individuals, roles, fan_out, tbox_depth,
+            classes_per_level, seed)
+        for run in range(runs):
+            concept = random_concept(rng, classes, role_names, disjuncts,
+                                     conjuncts, nesting)
+            individual = rng.choice(individual_names)
+            # the run is inherited by the forked process instead of pickled
+            global _next_run
+            _next_run = (file_name, concept, individual, goal_is_hold,
+                         workers)
+            with ProcessPoolExecutor(
+                    1, mp_context=multiprocessing.get_context('fork')) \
+                    as executor:
+                result = executor.submit(_run_next).result()
+            result.update(run=run, individual=individual,
+                          concept=str(concept))
+            results.append(result)
+    return {'config': config, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the CounterfactualCandidateGenerator on '
+                    'synthetic ALCH ontologies.')
+    parser.add_argument('--individuals', type=int, default=1000)
+    parser.add_argument('--roles', type=int, default=3)
+    parser.add_argument('--fan-out', type=int, default=3)
+    parser.add_argument('--tbox-depth', type=int, default=3)
+    parser.add_argument('--classes-per-level', type=int, default=4)
+    parser.add_argument('--disjuncts', type=int, default=3)
+    parser.add_argument('--conjuncts', type=int, default=3)
+    parser.add_argument('--nesting', type=int, default=2)
+    parser.add_argument('--not-hold', action='store_true',
+                        help='make the concept not hold instead of hold')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='JSON file for the results, default is stdout')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.individuals, args.roles, args.fan_out,
+                           args.tbox_depth, args.classes_per_level,
+                           args.disjuncts, args.conjuncts, args.nesting,
+                           not args.not_hold, args.runs, args.workers,
+                           args.seed)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
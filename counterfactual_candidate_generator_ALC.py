@@ -1,14 +1,24 @@
-from ontolearn.knowledge_base import KnowledgeBase
 from owlapy.model import OWLObjectProperty, OWLObjectPropertyAssertionAxiom, \
     OWLClassAssertionAxiom, IRI, OWLObjectSomeValuesFrom, OWLObjectUnionOf, \
     OWLObjectIntersectionOf, OWLClass, OWLObjectComplementOf, \
-    OWLObjectAllValuesFrom, OWLNamedIndividual
-from owlapy.owlready2._base import OWLReasoner_Owlready2, \
-    OWLOntologyManager_Owlready2
-from owlapy.owlready2.complex_ce_instances import OWLReasoner_Owlready2_ComplexCEInstances
+    OWLObjectAllValuesFrom, OWLNamedIndividual, OWLThing
 from collections import OrderedDict
+from contextlib import contextmanager
 from owlapy.util import NNF, TopLevelCNF, TopLevelDNF
+import atexit
+import bisect
+import hashlib
+import heapq
+import importlib
+import itertools
+import json
+import logging
 import os
+import shutil
+import tempfile
+import threading
+import time
+import types
 
 '''
 This is an implementation of the counterfactual KB algorithm from the paper "Counterfactual Explanations for
@@ -18,20 +28,1177 @@ Given a knowledge base and a concept CC in ALCH and an individual in that KB,
 we create counterfactuals of this KB where K does not model CC(x).
 '''
 
+_logger = logging.getLogger(__name__)
+
+# heavy dependencies, imported on first use (see _import); asyncio,
+# multiprocessing, sqlite3, pickle and concurrent.futures are imported
+# where the service, the worker pool and the SQLite files are used
+_lazy_imports = {
+    'KnowledgeBase': 'ontolearn.knowledge_base',
+    'OWLReasoner_Owlready2': 'owlapy.owlready2._base',
+    'OWLOntologyManager_Owlready2': 'owlapy.owlready2._base',
+    'OWLOntology_Owlready2': 'owlapy.owlready2._base',
+    'ToOwlready2': 'owlapy.owlready2.utils',
+    'OwlReadyInconsistentOntologyError': 'owlready2',
+    'Thing': 'owlready2',
+    'destroy_entity': 'owlready2',
+    'rdf_type': 'owlready2',
+    'sync_reasoner_pellet': 'owlready2'}
+
+
+def _import(name):
+    '''
+    Imports a heavy dependency on first use and keeps it as module global,
+    so it can still be replaced like a regular import (e.g. to count
+    ontology loads).
+    '''
+    if name not in globals():
+        globals()[name] = getattr(
+            importlib.import_module(_lazy_imports[name]), name)
+    return globals()[name]
+
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        return _import(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Instrumentation:
+    '''
+    Timers, counters and progress events of a generator.
+    Phases (normalization, reasoner_build, index_build, kb_copy, edit,
+    instance_check, save) are timed in total and per candidate, counters
+    count e.g. reasoner_calls, axioms_added and axioms_removed.
+    Events go to the logger (nothing is printed unless logging is
+    configured) and to the optional callback.
+    Args:
+        callback: function called as callback(event, data) for every event
+        logger: logger for the events, defaults to the logger of this module
+    '''
+
+    __slots__ = 'timers', 'counters', '_current', '_callback', '_logger'
+
+    def __init__(self, callback=None, logger=None):
+        self.timers = {}
+        self.counters = {}
+        self._current = {}
+        self._callback = callback
+        self._logger = logger if logger is not None else _logger
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter()-start
+            self.timers[name] = self.timers.get(name, 0.0)+elapsed
+            self._current[name] = self._current.get(name, 0.0)+elapsed
+
+    def count(self, name, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0)+n
+
+    def event(self, name, /, level: int = logging.INFO, **data):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, '%s %s', name, data)
+        if self._callback is not None:
+            self._callback(name, data)
+
+    def take_candidate_timings(self):
+        '''
+        Returns the phase timings since the last call and resets them.
+        '''
+        current = self._current
+        self._current = {}
+        return current
+
+    def merge(self, timers, counters):
+        '''
+        Adds timings and counters of another process (e.g. a worker).
+        '''
+        for name, elapsed in timers.items():
+            self.timers[name] = self.timers.get(name, 0.0)+elapsed
+            self._current[name] = self._current.get(name, 0.0)+elapsed
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def report(self):
+        return {'timers': dict(self.timers), 'counters': dict(self.counters)}
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        self._current = {}
+
+
+class _IRITable:
+    '''
+    Interns IRIs as ints, so edit records are tuples of small ints instead
+    of owlapy axioms. Shared by all generators of a process, also by the
+    threads of an AsyncCandidateService. The IRIs are those of the
+    ontologies and the placeholders, whose names are reused by every run.
+    '''
+
+    __slots__ = '_ids', '_iris', '_lock'
+
+    def __init__(self):
+        self._ids = {}
+        self._iris = []
+        self._lock = threading.Lock()
+
+    def id(self, iri):
+        iri_id = self._ids.get(iri)
+        if iri_id is None:
+            with self._lock:
+                if iri not in self._ids:
+                    # the IRI is stored before its id is visible
+                    self._iris.append(iri)
+                    self._ids[iri] = len(self._iris)-1
+                iri_id = self._ids[iri]
+        return iri_id
+
+    def iri(self, iri_id):
+        return self._iris[iri_id]
+
+
+_iri_table = _IRITable()
+
+
+def _entity_id(entity):
+    return _iri_table.id(entity.get_iri().as_str())
+
+
+# an edit record is (individual id, class id, -1) for A(x) or
+# (subject id, role id, object id) for r(x, y)
+def _class_record(individual, a_class):
+    return (_entity_id(individual), _entity_id(a_class), -1)
+
+
+def _role_record(individual, role, an_object):
+    return (_entity_id(individual), _entity_id(role), _entity_id(an_object))
+
+
+class _OntologyOverlay:
+    '''
+    Copy-on-write view of a base ontology, used for "K' ← copy(K)".
+    Only the class and role assertions that are added or removed are
+    recorded, as edit records of interned IRIs; they are translated to
+    owlapy axioms only when the overlay is applied or read. The base
+    ontology is shared between all candidates and never copied.
+    Args:
+        base: the loaded base ontology
+    '''
+
+    __slots__ = '_base', '_manager', '_added', '_removed'
+
+    def __init__(self, base):
+        self._base = base
+        self._manager = base.get_owl_ontology_manager()
+        self._added = {}
+        self._removed = {}
+
+    def __len__(self):
+        return len(self._added) + len(self._removed)
+
+    @property
+    def added(self):
+        return [_axiom_from_record(record) for record in self._added]
+
+    @property
+    def removed(self):
+        return [_axiom_from_record(record) for record in self._removed]
+
+    def cost(self, individual):
+        '''
+        Number of changed assertions on individual.
+        '''
+        individual_id = _entity_id(individual)
+        return sum(1 for records in (self._added, self._removed)
+                   for record in records if record[0] == individual_id)
+
+    def add(self, record):
+        if record in self._removed:
+            del self._removed[record]
+        else:
+            self._added[record] = None
+
+    def remove(self, record):
+        if record in self._added:
+            del self._added[record]
+        else:
+            self._removed[record] = None
+
+    @contextmanager
+    def applied(self, reasoner=None):
+        '''
+        Applies the delta to the base ontology for the duration of the
+        with-block and reverts it afterwards.
+        Only axioms that really change the asserted triples of the base
+        ontology are applied, so reverting restores them exactly.
+        Inferences of reasoners must not be written into the base ontology
+        (see _IncrementalReasoner). An _IncrementalReasoner passed as
+        reasoner is told about both changes.
+        '''
+        world = self._base._world
+        removed_records = [record for record in self._removed
+                           if _is_asserted(self._base, record)]
+        added_records = [record for record in self._added
+                         if not _is_asserted(self._base, record)]
+        new_individuals = OrderedDict.fromkeys(
+            iri for record in added_records
+            for iri in _individual_iris(record) if world[iri] is None)
+        removed = [_axiom_from_record(record) for record in removed_records]
+        added = [_axiom_from_record(record) for record in added_records]
+        for axiom in removed:
+            self._manager.remove_axiom(self._base, axiom)
+        for axiom in added:
+            self._manager.add_axiom(self._base, axiom)
+        if reasoner is not None:
+            reasoner.update(added, removed)
+        try:
+            yield self._base
+        finally:
+            for axiom in reversed(added):
+                self._manager.remove_axiom(self._base, axiom)
+            for axiom in reversed(removed):
+                self._manager.add_axiom(self._base, axiom)
+            if reasoner is not None:
+                reasoner.update(removed, added)
+            # Ontolearn created these individuals for the added axioms
+            for iri in new_individuals:
+                if world[iri] is not None:
+                    _import('destroy_entity')(world[iri])
+
+    @classmethod
+    def from_tuples(cls, base, added, removed):
+        '''
+        Rebuilds an overlay from the output of to_tuples.
+        '''
+        overlay = cls(base)
+        for row in added:
+            overlay.add(_record_from_tuple(row))
+        for row in removed:
+            overlay.remove(_record_from_tuple(row))
+        return overlay
+
+    def to_tuples(self):
+        '''
+        The delta as plain IRI tuples, e.g. to send it between processes.
+        '''
+        return ([_record_to_tuple(record) for record in self._added],
+                [_record_to_tuple(record) for record in self._removed])
+
+    def save(self, file_name):
+        '''
+        Materializes base plus delta and saves it as .owl file.
+        '''
+        with self.applied() as onto:
+            self._manager.save_ontology(onto, IRI.create(f'file:/{file_name}'))
+
+
+def _axiom_from_record(record):
+    return _axiom_from_tuple(_record_to_tuple(record))
+
+
+def _record_to_tuple(record):
+    if record[2] == -1:
+        return ('class', _iri_table.iri(record[0]),
+                _iri_table.iri(record[1]))
+    return ('role', _iri_table.iri(record[0]), _iri_table.iri(record[1]),
+            _iri_table.iri(record[2]))
+
+
+def _record_from_tuple(row):
+    if row[0] == 'class':
+        return (_iri_table.id(row[1]), _iri_table.id(row[2]), -1)
+    return (_iri_table.id(row[1]), _iri_table.id(row[2]),
+            _iri_table.id(row[3]))
+
+
+def _axiom_from_tuple(row):
+    if row[0] == 'class':
+        return OWLClassAssertionAxiom(OWLNamedIndividual(IRI.create(row[1])),
+                                      OWLClass(IRI.create(row[2])))
+    return OWLObjectPropertyAssertionAxiom(
+        OWLNamedIndividual(IRI.create(row[1])),
+        OWLObjectProperty(IRI.create(row[2])),
+        OWLNamedIndividual(IRI.create(row[3])))
+
+
+def _individual_iris(record):
+    if record[2] == -1:
+        return [_iri_table.iri(record[0])]
+    return [_iri_table.iri(record[0]), _iri_table.iri(record[2])]
+
+
+def _is_asserted(onto, record):
+    '''
+    Checks if the assertion of an edit record is stated in onto itself.
+    Only the triples of onto count, facts that a reasoner wrote into other
+    ontologies of the same owlready2 world are no assertions.
+    '''
+    world = onto._world
+    storids = [world._abbreviate(_iri_table.iri(iri_id), False)
+               for iri_id in record if iri_id != -1]
+    if None in storids:
+        return False
+    if record[2] == -1:
+        return bool(onto._onto._has_obj_triple_spo(
+            storids[0], _import('rdf_type'), storids[1]))
+    return bool(onto._onto._has_obj_triple_spo(*storids))
+
+
+# the ontology Pellet writes its inferences into during an instance check
+_VERIFICATION_IRI = 'http://counterfactuals.verification/'
+
+
+class _IncrementalReasoner:
+    '''
+    Reasoner that is built once on the base ontology and is kept up to date
+    with assertion deltas instead of being rebuilt for every candidate.
+    Hierarchy, type and role queries go to an owlapy reasoner that does not
+    write into the world. Instances are entailed by Pellet, which writes
+    its inferences into a verification ontology that is destroyed right
+    after the check, so no inference stays in the base ontology or leaks
+    into later checks.
+    Instance sets are cached per concept and delta, so the checks on the
+    base ontology (e.g. of the fillers and of C(x) for the trivially
+    satisfied terms/clauses) run once per ontology. Every other delta
+    still costs one Pellet run over the whole world, i.e. over the ABox
+    module of the individual with extract_module.
+    Args:
+        onto: the base ontology
+        instrumentation: Instrumentation that counts the reasoner_calls
+        maxsize: maximal number of cached instance sets
+    '''
+
+    __slots__ = '_onto', '_reasoner', '_converter', '_checks', \
+        '_instances', '_maxsize', '_delta', '_super_classes', \
+        '_super_roles', '_subsumptions', '_instrumentation'
+
+    def __init__(self, onto, instrumentation, maxsize: int = 1024):
+        self._onto = onto
+        self._instrumentation = instrumentation
+        instrumentation.count('reasoner_builds')
+        self._reasoner = _import('OWLReasoner_Owlready2')(onto)
+        self._converter = _import('ToOwlready2')(world=onto._world)
+        self._checks = 0
+        self._instances = OrderedDict()
+        self._maxsize = maxsize
+        # axiom -> True if it is added to, False if removed from the base
+        self._delta = {}
+        self._super_classes = {}
+        self._super_roles = None
+        self._subsumptions = {}
+
+    def instances(self, concept, direct: bool = False):
+        if direct:
+            self._instrumentation.count('reasoner_calls')
+            return self._reasoner.instances(concept, direct=True)
+        key = (concept, frozenset(self._delta.items()))
+        if key in self._instances:
+            self._instances.move_to_end(key)
+        else:
+            self._instrumentation.count('reasoner_calls')
+            self._instances[key] = self._entailed_instances(concept)
+            if len(self._instances) > self._maxsize:
+                self._instances.popitem(last=False)
+        return self._instances[key]
+
+    def _entailed_instances(self, concept):
+
+        world = self._onto._world
+        verification = world.get_ontology(_VERIFICATION_IRI)
+        self._checks = self._checks+1
+        with verification:
+            check_class = types.new_class(f'Check{self._checks}',
+                                          (_import('Thing'),))
+            check_class.equivalent_to = [
+                self._converter.map_concept(concept)]
+        try:
+            # Pellet reasons over the whole world
+            _import('sync_reasoner_pellet')(verification, debug=0)
+            return frozenset(
+                OWLNamedIndividual(IRI.create(an_individual.iri))
+                for an_individual in check_class.instances(world=world))
+        finally:
+            verification.destroy(update_relation=True, update_is_a=True)
+
+    def object_property_values(self, individual, role):
+        self._instrumentation.count('reasoner_calls')
+        return self._reasoner.object_property_values(individual, role)
+
+    def sub_object_properties(self, role, direct: bool = False):
+        self._instrumentation.count('reasoner_calls')
+        return self._reasoner.sub_object_properties(role, direct=direct)
+
+    def sub_classes(self, concept, direct: bool = False):
+        self._instrumentation.count('reasoner_calls')
+        return self._reasoner.sub_classes(concept, direct=direct)
+
+    def types(self, individual, direct: bool = False):
+        self._instrumentation.count('reasoner_calls')
+        return self._reasoner.types(individual, direct=direct)
+
+    def super_classes(self, a_class):
+        '''
+        The class and all its super classes.
+        '''
+        return self._supers_of_class(a_class)
+
+    def is_subsumed(self, sub, sup):
+        '''
+        Cheap, sound but incomplete check of sub ⊑ sup for literals in NNF
+        using the class and role hierarchy of the TBox. Results are cached
+        per pair, assertion deltas do not change them.
+        '''
+        key = (sub, sup)
+        if key not in self._subsumptions:
+            self._subsumptions[key] = self._is_subsumed(sub, sup)
+        return self._subsumptions[key]
+
+    def _is_subsumed(self, sub, sup):
+
+        if sub == sup or sub.is_owl_nothing() or sup.is_owl_thing():
+            return True
+        if isinstance(sub, OWLClass) and isinstance(sup, OWLClass):
+            return sup in self._supers_of_class(sub)
+        if isinstance(sub, OWLObjectComplementOf) and \
+                isinstance(sup, OWLObjectComplementOf):
+            # ¬A ⊑ ¬B iff B ⊑ A
+            return self.is_subsumed(sup.get_operand(), sub.get_operand())
+        if isinstance(sub, OWLObjectSomeValuesFrom) and \
+                isinstance(sup, OWLObjectSomeValuesFrom):
+            # ∃r.C ⊑ ∃s.D if r ⊑ s and C ⊑ D
+            return sup.get_property() in self._supers_of_role(
+                sub.get_property()) and \
+                self.is_subsumed(sub.get_filler(), sup.get_filler())
+        if isinstance(sub, OWLObjectAllValuesFrom) and \
+                isinstance(sup, OWLObjectAllValuesFrom):
+            # ∀r.C ⊑ ∀s.D if s ⊑ r and C ⊑ D
+            return sub.get_property() in self._supers_of_role(
+                sup.get_property()) and \
+                self.is_subsumed(sub.get_filler(), sup.get_filler())
+        return False
+
+    def update(self, added, removed):
+        '''
+        Tells the reasoner that axioms were added to or removed from the
+        base ontology (reverting a delta passes them the other way round).
+        The cached instance sets are keyed on the whole delta and not
+        invalidated along the told hierarchy, defined classes, domains,
+        ranges and GCIs change instance sets beyond it.
+        '''
+        for axiom in added:
+            if self._delta.get(axiom) is False:
+                del self._delta[axiom]
+            else:
+                self._delta[axiom] = True
+        for axiom in removed:
+            if self._delta.get(axiom) is True:
+                del self._delta[axiom]
+            else:
+                self._delta[axiom] = False
+
+    def _supers_of_class(self, a_class):
+        if a_class not in self._super_classes:
+            supers = {a_class}
+            if isinstance(a_class, OWLClass):
+                self._instrumentation.count('reasoner_calls')
+                supers.update(self._reasoner.super_classes(a_class,
+                                                           direct=False))
+            self._super_classes[a_class] = supers
+        return self._super_classes[a_class]
+
+    def _supers_of_role(self, role):
+        if self._super_roles is None:
+            # the role hierarchy is closed once for all roles
+            self._super_roles = {}
+            for a_role in self._onto.object_properties_in_signature():
+                for sub_role in self.sub_object_properties(a_role):
+                    self._super_roles.setdefault(sub_role, set()).add(a_role)
+        return self._super_roles.get(role, set()) | {role}
+
+
+class _NeighbourhoodIndex:
+    '''
+    Inferred types and role successors of the individuals reachable from
+    an individual within the role depth of a concept, read from the
+    reasoner once per run. Successors are stored per role and closed under
+    the role hierarchy when they are read. The edit procedures keep the
+    index in sync, every change is journaled so a term/clause can be
+    rolled back to the base state.
+    Args:
+        reasoner: the _IncrementalReasoner of the base ontology
+        individual: the target individual
+        concept: the concept in NNF
+    '''
+
+    __slots__ = '_reasoner', '_sub_roles', '_types', '_successors', \
+        '_fresh', '_journal'
+
+    def __init__(self, reasoner, individual, concept):
+        self._reasoner = reasoner
+        self._sub_roles = {}
+        self._types = {}
+        self._successors = {}
+        # added individuals, they have no successors for any role
+        self._fresh = set()
+        self._journal = []
+        roles = [role for role in _signature(concept)
+                 if isinstance(role, OWLObjectProperty)]
+        frontier = [individual]
+        for depth in range(_role_depth(concept)+1):
+            next_frontier = []
+            for an_individual in frontier:
+                if an_individual in self._types:
+                    continue
+                self._load(an_individual)
+                if depth < _role_depth(concept):
+                    for role in roles:
+                        next_frontier.extend(self.successors(an_individual,
+                                                             role))
+            frontier = next_frontier
+        # the base state is never rolled back
+        self._journal = []
+
+    def __contains__(self, individual):
+        return individual in self._types
+
+    def _load(self, individual):
+        self._types[individual] = OrderedDict.fromkeys(
+            self._reasoner.types(individual, direct=False))
+        self._successors[individual] = {}
+        self._journal.append(('individual', individual))
+
+    def _role_successors(self, individual, role):
+        if individual not in self._types:
+            self._load(individual)
+        successors = self._successors[individual]
+        if role not in successors:
+            if individual in self._fresh:
+                # not in the ontology once its candidate is reverted
+                successors[role] = OrderedDict()
+            else:
+                successors[role] = OrderedDict.fromkeys(
+                    self._reasoner.object_property_values(individual, role))
+            self._journal.append(('role', individual, role))
+        return successors[role]
+
+    def sub_roles(self, role):
+        '''
+        The role and all its sub roles.
+        '''
+        if role not in self._sub_roles:
+            self._sub_roles[role] = [role] + list(
+                self._reasoner.sub_object_properties(role))
+        return self._sub_roles[role]
+
+    def has_type(self, individual, a_class):
+        if individual not in self._types:
+            self._load(individual)
+        return a_class in self._types[individual]
+
+    # all y with r'(x, y) and r' ⊑ r
+    def successors(self, individual, role):
+        role_object_list = OrderedDict()
+        for a_prop in self.sub_roles(role):
+            role_object_list.update(self._role_successors(individual, a_prop))
+        return list(role_object_list)
+
+    # only y with r(x, y) for exactly r
+    def role_successors(self, individual, role):
+        return list(self._role_successors(individual, role))
+
+    def _set(self, container, key):
+        if key not in container:
+            container[key] = None
+            self._journal.append(('add', container, key))
+
+    def _unset(self, container, key):
+        if key in container:
+            del container[key]
+            self._journal.append(('remove', container, key))
+
+    def add_class(self, individual, a_class):
+        if individual not in self._types:
+            self._load(individual)
+        for super_class in self._reasoner.super_classes(a_class):
+            self._set(self._types[individual], super_class)
+
+    def remove_class(self, individual, a_class):
+        if individual not in self._types:
+            self._load(individual)
+        # x is no instance of any subclass of A after removing A(x)
+        self._unset(self._types[individual], a_class)
+        for sub_class in self._reasoner.sub_classes(a_class):
+            self._unset(self._types[individual], sub_class)
+
+    def add_individual(self, individual):
+        '''
+        Adds a new individual (e.g. a placeholder) without assertions.
+        '''
+        if individual not in self._types:
+            self._types[individual] = OrderedDict()
+            self._successors[individual] = {}
+            self._fresh.add(individual)
+            self._journal.append(('individual', individual))
+
+    def add_role(self, individual, role, an_object):
+        self._set(self._role_successors(individual, role), an_object)
+
+    def remove_role(self, individual, role, an_object):
+        self._unset(self._role_successors(individual, role), an_object)
+
+    def mark(self):
+        return len(self._journal)
+
+    def rollback(self, mark):
+        '''
+        Undoes all changes made since mark.
+        '''
+        while len(self._journal) > mark:
+            entry = self._journal.pop()
+            if entry[0] == 'add':
+                del entry[1][entry[2]]
+            elif entry[0] == 'remove':
+                entry[1][entry[2]] = None
+            elif entry[0] == 'role':
+                del self._successors[entry[1]][entry[2]]
+            else:
+                del self._types[entry[1]]
+                del self._successors[entry[1]]
+                self._fresh.discard(entry[1])
+
+
+def _role_depth(concept):
+    '''
+    Nesting depth of the restrictions in an ALCH concept.
+    '''
+    if isinstance(concept, OWLObjectComplementOf):
+        return _role_depth(concept.get_operand())
+    if isinstance(concept, (OWLObjectIntersectionOf, OWLObjectUnionOf)):
+        return max(_role_depth(operand) for operand in concept.operands())
+    if isinstance(concept, (OWLObjectSomeValuesFrom, OWLObjectAllValuesFrom)):
+        return 1 + _role_depth(concept.get_filler())
+    return 0
+
+
+def _signature(concept):
+    '''
+    Named classes and object properties occurring in an ALCH concept.
+    '''
+    if isinstance(concept, OWLClass):
+        return frozenset([concept])
+    if isinstance(concept, OWLObjectComplementOf):
+        return _signature(concept.get_operand())
+    if isinstance(concept, (OWLObjectIntersectionOf, OWLObjectUnionOf)):
+        return frozenset().union(*(_signature(operand)
+                                   for operand in concept.operands()))
+    if isinstance(concept, (OWLObjectSomeValuesFrom, OWLObjectAllValuesFrom)):
+        return _signature(concept.get_filler()) | {concept.get_property()}
+    return frozenset()
+
+
+def _fresh_instance(concept):
+    '''
+    Checks if an individual without any assertions is an instance of concept.
+    '''
+    if isinstance(concept, OWLClass):
+        return concept.is_owl_thing()
+    if isinstance(concept, OWLObjectComplementOf):
+        return not _fresh_instance(concept.get_operand())
+    if isinstance(concept, OWLObjectIntersectionOf):
+        return all(_fresh_instance(operand) for operand in concept.operands())
+    if isinstance(concept, OWLObjectUnionOf):
+        return any(_fresh_instance(operand) for operand in concept.operands())
+    return isinstance(concept, OWLObjectAllValuesFrom)
+
+
+def _reduce_iri(iri):
+    return IRI, (iri.get_namespace(), iri.get_remainder())
+
+
+class _NormalFormStore:
+    '''
+    Normal forms of concepts persisted in an SQLite file, so repeated runs
+    over the same concept skip the normalization. New forms are written
+    one by one, the least recently used ones are evicted when there are
+    more than max_entries.
+    Args:
+        file_name: the SQLite database file
+        max_entries: maximal number of normal forms kept
+    '''
+
+    __slots__ = 'file_name', 'max_entries', '_connection'
+
+    def __init__(self, file_name, max_entries: int = 10000):
+        import sqlite3
+        self.file_name = file_name
+        self.max_entries = max_entries
+        # the generator may be used from another thread than it was built
+        # in (see AsyncCandidateService), its runs are serialized
+        self._connection = sqlite3.connect(file_name,
+                                           check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS forms '
+                '(key TEXT PRIMARY KEY, form BLOB NOT NULL, '
+                'last_used REAL NOT NULL)')
+
+    def get(self, key):
+        import pickle
+        row = self._connection.execute(
+            'SELECT form FROM forms WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute(
+                'UPDATE forms SET last_used = ? WHERE key = ?',
+                (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, form):
+        import io
+        import pickle
+        data = io.BytesIO()
+        pickler = pickle.Pickler(data)
+        # IRIs compare their namespaces by identity, loading them through
+        # IRI interns the namespace again
+        pickler.dispatch_table = {IRI: _reduce_iri}
+        pickler.dump(form)
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO forms VALUES (?, ?, ?)',
+                (key, data.getvalue(), time.time()))
+            self._connection.execute(
+                'DELETE FROM forms WHERE key NOT IN (SELECT key FROM '
+                'forms ORDER BY last_used DESC LIMIT ?)',
+                (self.max_entries,))
+
+    def close(self):
+        self._connection.close()
+
+
+class _NormalFormCache:
+    '''
+    Bounded LRU cache for the normal forms of concepts, shared by all
+    generators, also by the threads of an AsyncCandidateService. Concepts
+    are compared structurally, so equal concepts of different generators
+    hit the same entry. A generator can pass its
+    _NormalFormStore to get, so its misses are also looked up in and
+    written to that file.
+    Args:
+        maxsize: maximal number of entries kept in memory
+    '''
+
+    __slots__ = '_maxsize', '_cache', '_lock'
+
+    _forms = {'nnf': lambda concept: NNF().get_class_nnf(concept),
+              'tldnf': lambda concept: TopLevelDNF().get_top_level_dnf(concept),
+              'tlcnf': lambda concept: TopLevelCNF().get_top_level_cnf(concept)}
+
+    def __init__(self, maxsize: int = 256):
+        self._maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, form, concept, store: _NormalFormStore = None):
+        key = (form, concept)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                return result
+        # normalized outside of the lock, other threads need not wait
+        if store is not None:
+            persisted_key = f'{form} {concept!r}'
+            result = store.get(persisted_key)
+        if result is None:
+            result = self._forms[form](concept)
+            if store is not None:
+                store.put(persisted_key, result)
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+        return result
+
+
+_normal_forms = _NormalFormCache()
+
+
+class CounterfactualCandidate:
+    '''
+    A verified counterfactual candidate.
+    Args:
+        name: name of the candidate, e.g. Candidate0
+        concept_part: the term/clause (list of concepts) it was built for
+        overlay: the _OntologyOverlay with its changes to the base ontology
+        cost: number of changed assertions of the individual
+    '''
+
+    __slots__ = 'name', 'concept_part', 'cost', '_overlay'
+
+    def __init__(self, name, concept_part, overlay, cost: int = None):
+        self.name = name
+        self.concept_part = concept_part
+        self.cost = cost
+        self._overlay = overlay
+
+    def __repr__(self):
+        return (f"CounterfactualCandidate('{self.name}', "
+                + f"{self.concept_part}, +{len(self.added)}, "
+                + f"-{len(self.removed)})")
+
+    @property
+    def added(self):
+        return self._overlay.added
+
+    @property
+    def removed(self):
+        return self._overlay.removed
+
+    def applied(self):
+        '''
+        Context manager that gives the materialized ontology of the
+        candidate for the duration of the with-block.
+        '''
+        return self._overlay.applied()
+
+    def save(self, file_name):
+        self._overlay.save(file_name)
+
+    def changes(self):
+        '''
+        The added and removed assertions as IRI tuples.
+        '''
+        return self._overlay.to_tuples()
+
+
+class ChangeSetWriter:
+    '''
+    Saves candidates compactly as their changes to the base ontology.
+    The first line of the file references the base ontology with its
+    SHA-256 checksum, every further line is one candidate in JSON with
+    its added and removed assertions. Writes are buffered.
+    Args:
+        file_name: the change set file (.jsonl)
+        data_file: the base .owl ontology file
+        buffer_size: size of the write buffer in bytes
+    '''
+
+    __slots__ = 'file_name', '_file'
+
+    def __init__(self, file_name, data_file, buffer_size: int = 1 << 20):
+        self.file_name = file_name
+        self._file = open(file_name, 'w', encoding='utf-8',
+                          buffering=buffer_size)
+        self._write_line({'base': os.path.abspath(data_file),
+                          'sha256': _file_sha256(data_file)})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_line(self, entry):
+        self._file.write(json.dumps(entry))
+        self._file.write('\n')
+
+    def write(self, candidate):
+        self._write_line(_change_entry(candidate))
+
+    def close(self):
+        self._file.close()
+
+
+def _change_entry(candidate):
+    added, removed = candidate.changes()
+    return {'name': candidate.name,
+            'concept_part': str(candidate.concept_part),
+            'cost': candidate.cost,
+            'added': added,
+            'removed': removed}
+
+
+def read_change_set(file_name):
+    '''
+    Reads a change set file written by ChangeSetWriter.
+    Returns the header (base ontology and checksum) and a dict of the
+    candidates by name.
+    '''
+    with open(file_name, encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        candidates = OrderedDict()
+        for line in file:
+            entry = json.loads(line)
+            candidates[entry['name']] = entry
+    return header, candidates
+
+
+def load_candidate(file_name, name, check_base: bool = True):
+    '''
+    Rebuilds the ontology of one saved candidate from a change set file.
+    Args:
+        file_name: the change set file (.jsonl)
+        name: name of the candidate, e.g. Candidate0
+        check_base: set True to make sure the base ontology was not
+            changed since the change set was written
+    Returns a KnowledgeBase of the base ontology with the changes applied.
+    '''
+    header, candidates = read_change_set(file_name)
+    if check_base and _file_sha256(header['base']) != header['sha256']:
+        raise ValueError(f"{header['base']} was changed since "
+                         f"{file_name} was written.")
+    entry = candidates[name]
+    kb = _import('KnowledgeBase')(path=header['base'])
+    onto = kb.ontology()
+    manager = onto.get_owl_ontology_manager()
+    for row in entry['removed']:
+        manager.remove_axiom(onto, _axiom_from_tuple(row))
+    for row in entry['added']:
+        manager.add_axiom(onto, _axiom_from_tuple(row))
+    return kb
+
+
+def _load_ontology(data_file, snapshot: str = None):
+    '''
+    Loads data_file as owlapy ontology.
+    With a snapshot file, the parsed ontology is kept as owlready2 SQLite
+    quadstore, compiled on the first load and again whenever the SHA-256
+    checksum of data_file changes, so later loads skip the XML parsing.
+    Every load works on a private copy of the snapshot, changes of the
+    generator never reach it.
+    Returns the ontology and the file of its private copy (None without
+    snapshot), which the caller removes when it is done with the ontology.
+    '''
+    if snapshot is None:
+        return _import('KnowledgeBase')(path=data_file).ontology(), None
+    sha256 = _file_sha256(data_file)
+    meta_file = f'{snapshot}.json'
+    meta = None
+    if os.path.exists(snapshot) and os.path.exists(meta_file):
+        with open(meta_file, encoding='utf-8') as file:
+            meta = json.load(file)
+    if meta is None or meta['sha256'] != sha256:
+        # compiled next to the snapshot and moved in place, so concurrent
+        # loads never see a half written snapshot
+        handle, compiled = tempfile.mkstemp(
+            suffix='.tmp', dir=os.path.dirname(os.path.abspath(snapshot)))
+        os.close(handle)
+        try:
+            manager = _import('OWLOntologyManager_Owlready2')(
+                world_store=compiled)
+            onto = manager.load_ontology(
+                IRI.create(f'file://{os.path.abspath(data_file)}'))
+            meta = {'sha256': sha256, 'base_iri': onto._onto.base_iri}
+            onto._world.save()
+            onto._world.close()
+            os.replace(compiled, snapshot)
+        finally:
+            _remove_file(compiled)
+        with open(f'{meta_file}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(f'{meta_file}.tmp', meta_file)
+    handle, copy = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(handle)
+    shutil.copyfile(snapshot, copy)
+    # in case the caller never removes it
+    atexit.register(_remove_file, copy)
+    manager = _import('OWLOntologyManager_Owlready2')(world_store=copy)
+    onto = _import('OWLOntology_Owlready2')(
+        manager, IRI.create(meta['base_iri']), load=False)
+    return onto, copy
+
+
+def _remove_file(file_name):
+    if os.path.exists(file_name):
+        os.remove(file_name)
+
+
+def _file_sha256(file_name):
+    sha256 = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ResultCache:
+    '''
+    Persistent cache of the change sets of whole runs in an SQLite file.
+    A run is identified by the SHA-256 checksum of the ontology file, the
+    normalized concept, the individual, the namespace (placeholder IRIs of
+    the change sets are in it), goal_is_hold and the protected features.
+    The least recently used runs are evicted when there are
+    more than max_entries.
+    Args:
+        file_name: the SQLite database file
+        max_entries: maximal number of runs kept
+    '''
+
+    __slots__ = 'file_name', 'max_entries', '_connection'
+
+    def __init__(self, file_name, max_entries: int = 1000):
+        import sqlite3
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(file_name)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, candidates TEXT NOT NULL, '
+                'last_used REAL NOT NULL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def key(data_file, concept, individual, namespace: str,
+            goal_is_hold: bool = True, protected: list = None,
+            protect_sub_features: bool = False):
+        '''
+        The key of a run, see CounterfactualCandidateGenerator for the
+        arguments.
+        '''
+        protected_iris = sorted(feature.get_iri().as_str()
+                                for feature in protected or [])
+        return hashlib.sha256(json.dumps(
+            [_file_sha256(data_file),
+             repr(_normal_forms.get('nnf', concept)),
+             individual.get_iri().as_str(), namespace, goal_is_hold,
+             protected_iris, protect_sub_features]).encode()).hexdigest()
+
+    def get(self, key):
+        '''
+        Returns the change set entries (see read_change_set) stored for
+        key by name, or None.
+        '''
+        row = self._connection.execute(
+            'SELECT candidates FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute(
+                'UPDATE results SET last_used = ? WHERE key = ?',
+                (time.time(), key))
+        return OrderedDict((entry['name'], entry)
+                           for entry in json.loads(row[0]))
+
+    def put(self, key, entries):
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                (key, json.dumps(list(entries)), time.time()))
+            self._connection.execute(
+                'DELETE FROM results WHERE key NOT IN (SELECT key FROM '
+                'results ORDER BY last_used DESC LIMIT ?)',
+                (self.max_entries,))
+
+    def close(self):
+        self._connection.close()
+
+
+def generate_change_sets(concept, data_file, individual, namespace: str,
+                         goal_is_hold: bool = True, protected: list = None,
+                         result_cache: ResultCache = None, workers: int = 1,
+                         **options):
+    '''
+    Creates the candidates of an individual as change set entries (see
+    read_change_set) by name. With a result_cache a run that was done
+    before returns the stored entries without loading the ontology.
+    Further options are passed to CounterfactualCandidateGenerator, the
+    candidates are only saved with saving=True.
+    '''
+    options.setdefault('saving', False)
+    if result_cache is not None:
+        key = ResultCache.key(data_file, concept, individual, namespace,
+                              goal_is_hold, protected,
+                              options.get('protect_sub_features', False))
+        entries = result_cache.get(key)
+        if entries is not None:
+            _logger.info('result cache hit for %s', individual)
+            return entries
+    generator = CounterfactualCandidateGenerator(
+        concept, data_file, individual, namespace, goal_is_hold,
+        protected=protected, **options)
+    try:
+        entries = OrderedDict((candidate.name, _change_entry(candidate))
+                              for candidate
+                              in generator.iter_candidates(workers=workers))
+    finally:
+        # e.g. the copy of a snapshot and the normal form file
+        generator.close()
+    if result_cache is not None:
+        result_cache.put(key, entries.values())
+    return entries
+
+
+# generator that forked worker processes build their candidates with
+_worker_generator = None
+
+
+def _candidate_worker(index):
+    instrumentation = _worker_generator.instrumentation
+    instrumentation.reset()
+    overlay = _worker_generator._make_candidate(index)
+    report = instrumentation.report()
+    if overlay is None:
+        return None, report
+    return overlay.to_tuples(), report
+
+
 class CounterfactualCandidateGenerator:
     '''
     Creates counterfactual candidates from an individual regarding a concept.
     Args: 
         concept: an OWLObject concept in ALCH
         data_file: link to an .owl ontology file
-        individual: an individual of type OWLNamedIndividual in that ontology
+        individual: an individual of type OWLNamedIndividual in that ontology,
+            can be None when only generate_batch is used
         namespace: the namespace of that ontology
         goal_is_hold: set True if the goal is to make the concept hold, 
             False if goal is to make the concept not hold for the individual
-        saving: set True to save the resulting changed KnowledgeBases
-            containing the counterfactuals as .owl ontology files
+        saving: set True to save the resulting counterfactuals
+        save_format: 'changes' writes the added and removed assertions of
+            all candidates of a run into one Candidates_<run id>.jsonl file
+            (see change_set_file, ChangeSetWriter and load_candidate), the
+            run id is a hash of the individual, the concept and
+            goal_is_hold, so other runs in output_dir do not overwrite
+            it (change_set_file is the file of the last run). 'owl' writes
+            every changed KnowledgeBase as .owl ontology file
+        output_dir: directory the candidates are saved in, defaults to the
+            working directory
+        extract_module: set True to keep only the module of the ABox that
+            C(x) depends on: the individuals reachable from the individual
+            through the roles of the concept (and their sub roles) within
+            its nesting depth, together with the TBox. All candidates are
+            built and verified on the module, saved .owl candidates are
+            spliced back into the full ontology.
         protected: features that must not be changed. Provide as list of
         OWLClasses and OWLObjectProperties
+        protect_sub_features: set True to also protect the subclasses and
+            sub properties of the protected features
+        normal_form_cache: optional SQLite file to persist the normal
+            forms of concepts in, so later runs over the same concept skip
+            them (see _NormalFormStore), only used by this generator
+        snapshot: optional file to keep the parsed ontology in, so later
+            runs on the unchanged data_file skip the XML parsing (see
+            _load_ontology). Not possible with workers > 1, call close
+            to remove the private copy of the snapshot.
+        on_event: optional callback(event, data) for the progress events,
+            see Instrumentation (also available as instrumentation)
+
+    The ontology is loaded once. Every candidate only holds its delta to
+    it (kb_dict holds CounterfactualCandidates), the full ontology of a
+    candidate is only materialized when it is used or saved.
     
     
     __slots__ = '_concept', '_data_file', '_individual', '_namespace',\
@@ -43,13 +1210,32 @@ class CounterfactualCandidateGenerator:
     
     def __init__(self, concept, data_file, individual,
                  namespace: str, goal_is_hold: bool = True, 
-                 saving: bool = True, protected: list = None):
+                 saving: bool = True, protected: list = None,
+                 normal_form_cache: str = None,
+                 save_format: str = 'changes', output_dir: str = None,
+                 extract_module: bool = False, on_event=None,
+                 protect_sub_features: bool = False, snapshot: str = None):
 
-        self._concept = NNF().get_class_nnf(concept)
+        self.instrumentation = Instrumentation(on_event)
+        self._normal_form_store = None
+        if normal_form_cache is not None:
+            self._normal_form_store = _NormalFormStore(normal_form_cache)
+        with self.instrumentation.phase('normalization'):
+            self._concept = _normal_forms.get('nnf', concept,
+                                              self._normal_form_store)
         self._data_file = data_file
         self._individual = individual
         self._namespace = namespace
         self._saving = saving
+        if save_format not in ('changes', 'owl'):
+            raise ValueError(f"save_format must be 'changes' or 'owl', "
+                             f"not {save_format!r}")
+        self._save_format = save_format
+        self._output_dir = output_dir if output_dir is not None \
+            else os.getcwd()
+        self._change_set = None
+        self.change_set_file = None
+        self._placeholder_term = 0
         self._placeholder_count = 0
         self._goal_is_hold = goal_is_hold
         self.protected = protected
@@ -58,14 +1244,118 @@ class CounterfactualCandidateGenerator:
         self._concept_as_list = None
         self.candidate_dict = None
         self.kb_dict = None
-        self.onto = KnowledgeBase(path=self._data_file).ontology()
-        #self._manager = self.onto.get_owl_ontology_manager()
+        self._kb_count = 0
+        self._candidate_prefix = ''
+        self._snapshot = snapshot
+        self._snapshot_copies = []
+        self.onto = self._load_ontology()
+        self._manager = self.onto.get_owl_ontology_manager()
+        self._extract_module = extract_module
+        self._full_onto = None
+        if extract_module:
+            if individual is None:
+                raise ValueError("extract_module needs an individual.")
+            self._reduce_to_module()
+        with self.instrumentation.phase('reasoner_build'):
+            self._reasoner = _IncrementalReasoner(self.onto,
+                                                  self.instrumentation)
+        self._index = None
+        self._run_list = None
+        self._cancel = None
+        self._answers = {}
+        self._satisfied = set()
+        self._base_holds = None
+        self._compile_protection(protect_sub_features)
         
+    def set_concept(self, concept, goal_is_hold: bool = True,
+                    protected: list = None,
+                    protect_sub_features: bool = False, individual=None):
+        '''
+        Reuses the loaded ontology and reasoner for another concept and,
+        if an individual is given, for another individual.
+        Not possible with extract_module, the module depends on the
+        concept.
+        '''
+        if self._extract_module:
+            raise ValueError("set_concept can not be used with "
+                             "extract_module=True.")
+        with self.instrumentation.phase('normalization'):
+            self._concept = _normal_forms.get('nnf', concept,
+                                              self._normal_form_store)
+        self._goal_is_hold = goal_is_hold
+        if individual is not None:
+            self._individual = individual
+        self._concept_TLDNF = None
+        self._concept_TLCNF = None
+        self._concept_as_list = None
+        self.protected = protected
+        self._compile_protection(protect_sub_features)
+
     def __repr__(self):
-        return (f"CounterfactualCandidateGenerator('{self.concept}', "
+        return (f"CounterfactualCandidateGenerator('{self._concept}', "
                 + f"{self._data_file}, {self._individual}, "
                 + f"{self._namespace}, {self._saving})")
         
+    def _reduce_to_module(self):
+        '''
+        Removes all individuals from the loaded ontology that C(x) does not
+        depend on (see extract_module).
+        '''
+        reasoner = _import('OWLReasoner_Owlready2')(self.onto)
+        props_list = []
+        for role in _signature(self._concept):
+            if isinstance(role, OWLObjectProperty):
+                props_list.append(role)
+                props_list.extend(reasoner.sub_object_properties(role))
+        props_list = list(OrderedDict.fromkeys(props_list))
+        module = {self._individual}
+        frontier = [self._individual]
+        for _ in range(_role_depth(self._concept)):
+            next_frontier = []
+            for an_individual in frontier:
+                for a_prop in props_list:
+                    for an_object in reasoner.object_property_values(
+                            an_individual, a_prop):
+                        if an_object not in module:
+                            module.add(an_object)
+                            next_frontier.append(an_object)
+            frontier = next_frontier
+        module_iris = {an_individual.get_iri().as_str()
+                       for an_individual in module}
+        for an_individual in list(self.onto._onto.individuals()):
+            if an_individual.iri not in module_iris:
+                _import('destroy_entity')(an_individual)
+
+    def _load_ontology(self):
+
+        onto, copy = _load_ontology(self._data_file, self._snapshot)
+        if copy is not None:
+            self._snapshot_copies.append((onto, copy))
+        return onto
+
+    def close(self):
+        '''
+        Removes the private copies of the snapshot (see snapshot) and
+        closes the normal form file, the generator can not be used
+        afterwards.
+        '''
+        for onto, copy in self._snapshot_copies:
+            onto._world.close()
+            _remove_file(copy)
+        self._snapshot_copies = []
+        if self._normal_form_store is not None:
+            self._normal_form_store.close()
+            self._normal_form_store = None
+
+    def _full_ontology(self):
+        '''
+        The full ontology from data_file, loaded on first use to splice
+        module candidates into it.
+        '''
+        if self._full_onto is None:
+            self._full_onto = self._load_ontology()
+        return self._full_onto
+
     def _create_list(self):
         '''
         - Brings concept to TLDNF/TLCNF
@@ -74,7 +1364,8 @@ class CounterfactualCandidateGenerator:
         
         if self._goal_is_hold:       
             # Bring to top-level disjunctive normal form
-            self._concept_TLDNF = TopLevelDNF().get_top_level_dnf(self._concept)
+            self._concept_TLDNF = _normal_forms.get(
+                'tldnf', self._concept, self._normal_form_store)
             disj_of_conj_list = [] 
             if type(self._concept_TLDNF) == OWLObjectUnionOf:
                 for united in self._concept_TLDNF.operands():
@@ -96,7 +1387,8 @@ class CounterfactualCandidateGenerator:
 
         else:  
             # This is the same as above, only the lists are in TLCNF not TLDNF
-            self._concept_TLCNF = TopLevelCNF().get_top_level_cnf(self._concept)
+            self._concept_TLCNF = _normal_forms.get(
+                'tlcnf', self._concept, self._normal_form_store)
             conj_of_disj_list = [] 
             if type(self._concept_TLCNF) == OWLObjectIntersectionOf:
                 for intersected in self._concept_TLCNF.operands():
@@ -116,291 +1408,798 @@ class CounterfactualCandidateGenerator:
                 conj_of_disj_list.append(self._concept_TLCNF)
             return conj_of_disj_list
     
-    '''    
-    # add c(x')        
-    def _add_class(self, kb, class_concept, individual, reasoner, reasoner_sub):
-        # Nothing
-        if class_concept.is_owl_nothing():
-            print("Individual that is 'Nothing' can not exist.")
-            self._change_count = float('inf')
-        # Add
-        self._manager_editing.add_axiom(
-            kb.ontology(),
-            OWLClassAssertionAxiom(individual, 
-                                   class_concept))
-        # count
-        if individual == self._individual:
-            classes_list = list(reasoner.sub_classes(
-                                            class_concept))
-            classes_list.append(class_concept)
-            new_classes = []
-            for a_class in classes_list:
-                if a_class not in list(reasoner.types(
-                                individual, direct=False)):
-                    new_classes.append(a_class)
-            self._change_count = self._change_count + len(new_classes)
-            
-        # Subclasses of added classes are counted
-    
-    '''
+    def is_instance(self, individual, concept):
+        '''
+        Checks C(x) structurally on the neighbourhood of x (its class
+        assertions, its role successors and their fillers) instead of
+        computing all instances of C. Negation is negation as failure.
+        This closed world approximation only decides which literals of a
+        term/clause are edited and how terms/clauses are sorted before
+        the edits. What is removed for "K |= D(y)" and whether a candidate
+        is kept is decided by entailment (see _remove_objects and the
+        verification in _make_hold/_make_not_hold).
+        '''
+        if self._index is None:
+            # called before any run
+            self._index = _NeighbourhoodIndex(self._reasoner, individual,
+                                              self._concept)
+        if individual not in self._index and \
+                self.onto._world[individual.get_iri().as_str()] is None:
+            # placeholder individual that is not applied to the ontology
+            return _fresh_instance(concept)
+        if isinstance(concept, OWLClass):
+            if concept.is_owl_thing():
+                return True
+            if concept.is_owl_nothing():
+                return False
+            return self._index.has_type(individual, concept)
+        if isinstance(concept, OWLObjectComplementOf):
+            return not self.is_instance(individual, concept.get_operand())
+        if isinstance(concept, OWLObjectIntersectionOf):
+            return all(self.is_instance(individual, operand)
+                       for operand in concept.operands())
+        if isinstance(concept, OWLObjectUnionOf):
+            return any(self.is_instance(individual, operand)
+                       for operand in concept.operands())
+        if isinstance(concept, OWLObjectSomeValuesFrom):
+            return any(self.is_instance(an_object, concept.get_filler())
+                       for an_object in self._index.successors(
+                           individual, concept.get_property()))
+        if isinstance(concept, OWLObjectAllValuesFrom):
+            return all(self.is_instance(an_object, concept.get_filler())
+                       for an_object in self._index.successors(
+                           individual, concept.get_property()))
+        return individual in self._reasoner.instances(concept)
+
+    # add c(x')
+    def _add_class(self, overlay, class_concept, individual):
+
+        overlay.add(_class_record(individual, class_concept))
+        self._index.add_class(individual, class_concept)
+        self.instrumentation.count('axioms_added')
 
-    def _remove_class(self, kb, concept, individual):
+    def _remove_class(self, overlay, concept, individual):
 
-            self._manager_editing.remove_axiom(
-                kb.ontology(),
-                OWLClassAssertionAxiom(individual, 
-                                       concept))
+        overlay.remove(_class_record(individual, concept))
+        self._index.remove_class(individual, concept)
+        self.instrumentation.count('axioms_removed')
         
         # Subclasses of removed classes are not counted
+
+    # remove all r'(x, y) with r' ⊑ r and K |= D(y)
+    def _remove_objects(self, overlay, role, filler, individual, reasoner):
+
+        successors = [(a_prop, an_object)
+                      for a_prop in self._index.sub_roles(role)
+                      for an_object in self._index.role_successors(
+                          individual, a_prop)]
+        if not successors:
+            # e.g. a placeholder, no instance check needed
+            return
+        # "K |= D(y)" is entailment on K with the edits made so far, as in
+        # the verification, not the closed world check of is_instance
+        entailed = None
+        if not filler.is_owl_thing():
+            with overlay.applied(reasoner):
+                entailed = reasoner.instances(filler)
+        for a_prop, an_object in successors:
+            # Filler is Top concept (remove all r(x,y))
+            if entailed is not None and an_object not in entailed:
+                continue
+            overlay.remove(_role_record(individual, a_prop, an_object))
+            self._index.remove_role(individual, a_prop, an_object)
+            self.instrumentation.count('axioms_removed')
+
+    def _new_candidate(self, overlay, sub_list, timings = None):
+
+        name = f'{self._candidate_prefix}Candidate{self._kb_count}'
+        candidate = CounterfactualCandidate(
+            name, sub_list, overlay, overlay.cost(self._individual))
+
+        # Save changes or ontology file
+        if self._saving:
+            with self.instrumentation.phase('save'):
+                self._save(candidate)
+
+        self.instrumentation.event(
+            'candidate_created', name=name, concept_part=str(sub_list),
+            cost=candidate.cost,
+            timings=timings if timings is not None
+            else self.instrumentation.take_candidate_timings())
+        self._kb_count = self._kb_count+1
+        return candidate
         
-    def _make_hold(self, data_file, concept, individual):
-        
-        # Load reasoner    
-        reasoner = OWLReasoner_Owlready2_ComplexCEInstances(
-            KnowledgeBase(path=data_file).ontology(), 
-            infer_property_values = False, 
-            isolate = False)
-        
-        # Apply rewriting
-        
-        # Bring to tldnf
-        
-        #For term in CC do
-        for sub_list in self._concept_as_list: # "for term in CC do"
-                     
-            kb = KnowledgeBase(path=data_file) # "K' ← copy(K)"
-            self._manager = kb.ontology().get_owl_ontology_manager()
-            
-            if type(sub_list) != list:
-                sub_list = [sub_list]
-                
+    def _save(self, candidate):
+
+        if self._save_format == 'changes':
+            self._change_set.write(candidate)
+        else:
+            file_name = os.path.join(self._output_dir, f'{candidate.name}.owl')
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            if self._extract_module:
+                # splice the module delta into the full ontology
+                _OntologyOverlay.from_tuples(
+                    self._full_ontology(),
+                    *candidate.changes()).save(file_name)
+            else:
+                candidate.save(file_name)
+
+    def _make_hold(self, sub_list, max_cost = float('inf')):
+        '''
+        Builds the candidate for one term of the TLDNF.
+        Returns its overlay, or None if the concept does not hold in it
+        or more than max_cost assertions of the individual were changed.
+        '''
+        with self.instrumentation.phase('kb_copy'):
+            overlay = _OntologyOverlay(self.onto) # "K' ← copy(K)"
+        mark = self._index.mark()
+        try:
+            return self._make_hold_with(overlay, sub_list, max_cost)
+        finally:
+            self._index.rollback(mark)
+
+    def _make_hold_with(self, overlay, sub_list, max_cost):
+
+        reasoner = self._reasoner
+        try:
             for concept_part in sub_list: # "for C in term do"
+
+                with self.instrumentation.phase('edit'):
+                    if not self.is_instance(self._individual, concept_part):
+                        self._positive(overlay, concept_part,
+                                       self._individual, reasoner)
+                # branch and bound: abandon the term/clause
+                if overlay.cost(self._individual) > max_cost:
+                    return None
+
+            with self.instrumentation.phase('instance_check'):
+                with overlay.applied(reasoner):
+                    holds = self._individual in \
+                        reasoner.instances(self._concept)
+        except _import('OwlReadyInconsistentOntologyError'):
+            self._inconsistent(sub_list)
+            return None
+        if holds:
+            return overlay
+        return None
                 
-                if individual not in reasoner.instances(concept, direct=False): # Note: update to new method
-                    self.positive(kb, concept, individual)
-                    
-            reasoner_result = OWLReasoner_Owlready2_ComplexCEInstances(kb.ontology(), infer_property_values = True, isolate = False)
-            if self._individual in reasoner_result.instances(self._concept):
-                self.kb_dict[str(sub_list)] = kb
-
-            # Save ontology file
-                if self._saving:
-                    if (os.path.exists(
-                            f"/{os.getcwd()}/Candidate{kb_count}.owl"
-                            )):
-                        os.remove(
-                            f"/{os.getcwd()}/Candidate{kb_count}.owl")
-                    self._manager_editing.save_ontology(
-                        kb.ontology(),
-                        IRI.create(f'file:/Candidate{kb_count}.owl'))
-    
-                print(f"Candidate {kb_count} was created. \n"
-                       f"The concept part was {str(sub_list)}.")
-                self.candidate_dict[f'Candidate{kb_count}'] = {
-                    "concept_part": str(sub_list)}
-                kb_count = kb_count+1
-                
-        def _make_not_hold(self, data_file, concept, individual):
-            
-            # Load reasoner    
-            reasoner = OWLReasoner_Owlready2_ComplexCEInstances(
-                KnowledgeBase(path=data_file).ontology(), 
-                infer_property_values = False, 
-                isolate = False)
-            
-            # Apply rewriting
-            
-            # Bring to tlcnf
-            
-            #For clause in CC do
-            for sub_list in self._concept_as_list: # "for clause in CC do"
-                         
-                kb = KnowledgeBase(path=data_file) # "K' ← copy(K)"
-                self._manager = kb.ontology().get_owl_ontology_manager()
-                
-                if type(sub_list) != list:
-                    sub_list = [sub_list]
-                    
-                for concept_part in sub_list: # "for C in clause do"
-                    
-                    if individual in reasoner.instances(concept, direct=False): # Note: update to new method
-                        self.negative(kb, concept, individual)
-                        
-                reasoner_result = OWLReasoner_Owlready2_ComplexCEInstances(kb.ontology(), infer_property_values = True, isolate = False)
-                if self._individual not in reasoner_result.instances(self._concept):
-                    self.kb_dict[str(sub_list)] = kb
-
-                # Save ontology file
-                    if self._saving:
-                        if (os.path.exists(
-                                f"/{os.getcwd()}/Candidate{kb_count}.owl"
-                                )):
-                            os.remove(
-                                f"/{os.getcwd()}/Candidate{kb_count}.owl")
-                        self._manager_editing.save_ontology(
-                            kb.ontology(),
-                            IRI.create(f'file:/Candidate{kb_count}.owl'))
-        
-                    print(f"Candidate {kb_count} was created. \n"
-                           f"The concept part was {str(sub_list)}.")
-                    self.candidate_dict[f'Candidate{kb_count}'] = {
-                        "concept_part": str(sub_list)}
-                    kb_count = kb_count+1
+    def _make_not_hold(self, sub_list, max_cost = float('inf')):
+        '''
+        Builds the candidate for one clause of the TLCNF.
+        Returns its overlay, or None if the concept still holds in it
+        or more than max_cost assertions of the individual were changed.
+        '''
+        with self.instrumentation.phase('kb_copy'):
+            overlay = _OntologyOverlay(self.onto) # "K' ← copy(K)"
+        mark = self._index.mark()
+        try:
+            return self._make_not_hold_with(overlay, sub_list, max_cost)
+        finally:
+            self._index.rollback(mark)
+
+    def _make_not_hold_with(self, overlay, sub_list, max_cost):
+
+        reasoner = self._reasoner
+        try:
+            for concept_part in sub_list: # "for C in clause do"
+
+                with self.instrumentation.phase('edit'):
+                    if self.is_instance(self._individual, concept_part):
+                        self._negative(overlay, concept_part,
+                                       self._individual, reasoner)
+                # branch and bound: abandon the term/clause
+                if overlay.cost(self._individual) > max_cost:
+                    return None
+
+            with self.instrumentation.phase('instance_check'):
+                with overlay.applied(reasoner):
+                    holds = self._individual in \
+                        reasoner.instances(self._concept)
+        except _import('OwlReadyInconsistentOntologyError'):
+            self._inconsistent(sub_list)
+            return None
+        if not holds:
+            return overlay
+        return None
+
+    def _inconsistent(self, sub_list):
+
+        # e.g. A(x) was added while x is an instance of a class disjoint
+        # with A, the term/clause is dropped
+        self.instrumentation.event(
+            'impossible', individual=str(self._individual),
+            concept_part=str(sub_list),
+            reason='The edits make the knowledge base inconsistent.')
+
+    def _make_candidate(self, index, max_cost = float('inf')):
+        '''
+        Builds the candidate for the index-th term/clause of the run.
+        '''
+        sub_list = self._run_list[index]
+        # placeholder names only depend on the term/clause, so they are the
+        # same in workers and in a sequential run
+        self._placeholder_term = index
+        self._placeholder_count = 0
+
+        # timings of terms/clauses without candidate are not reported
+        self.instrumentation.take_candidate_timings()
+
+        if tuple(sub_list) in self._satisfied:
+            # one instance check on the base ontology for all of them
+            if self._base_holds is None:
+                with self.instrumentation.phase('instance_check'):
+                    self._base_holds = self._individual in \
+                        self._reasoner.instances(self._concept)
+            if self._base_holds == self._goal_is_hold:
+                return _OntologyOverlay(self.onto)
+            return None
+        if self._goal_is_hold:
+            return self._make_hold(sub_list, max_cost)
+        return self._make_not_hold(sub_list, max_cost)
+
+    def _lower_bound(self, sub_list):
+        '''
+        A term/clause with a literal that has to be changed costs at least
+        one changed assertion of the individual. Counting every such
+        literal would not be admissible, one edit can change several of
+        them (e.g. adding A(x) makes B hold for A ⊑ B).
+        '''
+        return int(any(self._answer(concept_part) != self._goal_is_hold
+                       and not self.check_protection(concept_part,
+                                                     verbose = False)
+                       for concept_part in sub_list))
+
+    def _iter_best_first(self, limit):
+        '''
+        Best-first search over the terms/clauses, ordered by the lower bound
+        of their cost. A candidate is yielded once no remaining term/clause
+        can be cheaper, so candidates come in order of increasing cost.
+        With a limit, branches that get more expensive than the limit-th
+        cheapest candidate found so far are abandoned.
+        '''
+        queue = [(self._lower_bound(sub_list), index)
+                 for index, sub_list in enumerate(self._run_list)]
+        heapq.heapify(queue)
+        found = [] # (cost, index, overlay, timings) of candidates not yielded
+        best_costs = [] # costs of the cheapest candidates found so far
+        yielded = 0
+        while queue or found:
+            next_bound = queue[0][0] if queue else float('inf')
+            while found and found[0][0] <= next_bound:
+                cost, index, overlay, timings = heapq.heappop(found)
+                yield self._new_candidate(overlay,
+                                          self._run_list[index],
+                                          timings)
+                yielded = yielded+1
+                if limit is not None and yielded >= limit:
+                    return
+            if not queue or self._cancelled():
+                queue = []
+                continue
+            max_cost = float('inf')
+            if limit is not None and len(best_costs) >= limit:
+                max_cost = best_costs[limit-1]
+            bound, index = heapq.heappop(queue)
+            if bound > max_cost:
+                # the queue is sorted, no other term/clause can be cheaper
+                queue = []
+                continue
+            overlay = self._make_candidate(index,
+                                           max_cost)
+            if overlay is not None:
+                cost = overlay.cost(self._individual)
+                heapq.heappush(found, (
+                    cost, index, overlay,
+                    self.instrumentation.take_candidate_timings()))
+                bisect.insort(best_costs, cost)
+
+    # "hold(K, y, D)" for an individual y that has no assertions yet
+    def _hold(self, overlay, concept, individual, reasoner):
+
+        if isinstance(concept, OWLObjectIntersectionOf):
+            for operand in concept.operands():
+                self._hold(overlay, operand, individual, reasoner)
+        # y is new, so it is enough to make one of the disjuncts hold
+        elif isinstance(concept, OWLObjectUnionOf):
+            self._hold(overlay, next(iter(concept.operands())),
+                       individual, reasoner)
+        else:
+            self._positive(overlay, concept, individual, reasoner)
                     
-    def _positive(kb, concept, individual):
+    def _positive(self, overlay, concept, individual, reasoner):
               
         # handle protected
         if individual == self._individual:
             # if feature is protected, abort
-            if self.check_protection(kb, concept, individual):
+            if self.check_protection(concept):
                 return
             
         # handle bottom concept
-        elif class_concept.is_owl_nothing():
-            print("Individual that is 'Nothing' can not exist.")
+        if concept.is_owl_nothing():
+            self.instrumentation.event(
+                'impossible', individual=str(individual),
+                reason="Individual that is 'Nothing' can not exist.")
             return
         
         # Complement of Class
         elif isinstance(concept, OWLObjectComplementOf):
             to_negative = concept.get_operand()
-            self._negative(kb, to_negative, individual)    
+            self._negative(overlay, to_negative, individual, reasoner)    
         
         # if C = ∃r.D
-        if isinstance(concept, OWLObjectSomeValuesFrom):
-            self.add_object(kb, concept, individual, holds = True)
-
-#        
-#        7:
-#        add y, add r(x, y), hold (K, y, D, KBs, P ).
-#        8: else if C = ∀r.D then
-#        9:
-#        remove all r(x, yi ) with K |= ¬D(yi )(i ≥ 0).
-#        10: else
-#        11:
-#        add C(x)
-#       12: end if
+        # add y, add r(x, y), hold (K, y, D)
+        elif isinstance(concept, OWLObjectSomeValuesFrom):
+            self.add_object(overlay, concept, individual, reasoner,
+                            holds = True)
+
+        # if C = ∀r.D
+        # remove all r(x, yi) with K |= ¬D(yi)
+        elif isinstance(concept, OWLObjectAllValuesFrom):
+            self._remove_objects(
+                overlay, concept.get_property(),
+                NNF().get_class_nnf(
+                    OWLObjectComplementOf(concept.get_filler())),
+                individual, reasoner)
+
+        # add C(x)
+        elif isinstance(concept, OWLClass):
+            self._add_class(overlay, concept, individual)
+
 #       13: if ¬C(x) ∈ A then
 #       14:
 #        remove ¬C(x)
 #        15: end if
 
-    def _negative(kb, concept, individual):
+    def _negative(self, overlay, concept, individual, reasoner):
       
         # handle protected
         if individual == self._individual:
             # if feature is protected, abort
-            if self.check_protection(kb, concept, individual):
+            if self.check_protection(concept):
                 return 
             
         # handle top concept
-        elif class_concept.is_owl_thing():
-            print("Individual that is not 'Thing' can not exist.")
+        if concept.is_owl_thing():
+            self.instrumentation.event(
+                'impossible', individual=str(individual),
+                reason="Individual that is not 'Thing' can not exist.")
             return
             
         # Complement of Class
         elif isinstance(concept, OWLObjectComplementOf):
             to_positive = concept.get_operand()
-            self._positive(kb, to_positive, individual)
+            self._positive(overlay, to_positive, individual, reasoner)
             
         else:
             # Class
             if isinstance(concept, OWLClass):
-                self._remove_class(kb, concept, individual)
+                self._remove_class(overlay, concept, individual)
             
-                # Existential restriction
-                # remove all r(x, yi) with K |= D(yi )
+            # Existential restriction
+            # remove all r(x, yi) with K |= D(yi)
             if isinstance(concept, OWLObjectSomeValuesFrom):
-                
-                role_name = concept.get_property().get_iri()._remainder
-                role = concept.get_property()
-                role_object_list = [] # list of other individuals y with r(x,y)
-                for a_prop in props_list_names:
-                    for y in list(reasoner.object_property_values(
-                                    individual,
-                                    role)):
-                        role_object_list.append(y)
-                role_object_list = list(OrderedDict.fromkeys(role_object_list))
-
-                # Filler is Top concept (remove all r(x,y))
-                if concept.get_filler().is_owl_thing():
-                    for any_object in role_object_list:
-                        property_remove = OWLObjectPropertyAssertionAxiom( 
-                                        individual,                  
-                                        OWLObjectProperty(                 
-                                            IRI(self._namespace,
-                                                f'{a_prop}')), 
-                                        an_object)                                 
-                        self._manager_editing.remove_axiom(onto, 
-                                                            property_remove)
-
-                # Filler is any other Concept D (remove only r(x,y) with D(y))
-                else:
-                    role_objects_in_restriction_concept = [] # y with D(y)
-                    for an_object in role_object_list:
-                        if an_object in list(reasoner_sub.instances(
-                                        concept.get_filler())):
-                            role_objects_in_restriction_concept.append(an_object)
-                    # Removing
-                    for relevant_object in role_objects_in_restriction_concept:
-                        property_remove = OWLObjectPropertyAssertionAxiom(
-                                            individual,
-                                            role,
-                                            relevant_object)
-                        self._manager_editing.remove_axiom(onto,
-                                                            property_remove)
-            
-                
+                self._remove_objects(overlay, concept.get_property(),
+                                     concept.get_filler(), individual,
+                                     reasoner)
 
             # add y, add r(x',y), hold(K, y, ¬D)
             if isinstance(concept, OWLObjectAllValuesFrom):
-                self.add_object(kb, concept, individual, holds = False)
+                self.add_object(overlay, concept, individual, reasoner,
+                                holds = False)
             
             
-    def add_object(kb, concept, individual, holds: bool = True):
-        a_prop = concept._property
-        a_filler = concept._filler
+    def add_object(self, overlay, concept, individual, reasoner,
+                   holds: bool = True):
+        a_prop = concept.get_property()
+        a_filler = concept.get_filler()
         placeholder_individual = OWLNamedIndividual(IRI(self._namespace, 
-            f'PH{self._placeholder_count}'))
-        property_add = OWLObjectPropertyAssertionAxiom(individual, 
-            a_prop, placeholder_individual)
-        self._manager_editing.add_axiom(onto, property_add) # Ontolearn creates the individual y automatically
+            f'PH{self._placeholder_term}_{self._placeholder_count}'))
+        # Ontolearn creates the individual y automatically
+        overlay.add(_role_record(individual, a_prop, placeholder_individual))
+        self._index.add_individual(placeholder_individual)
+        self._index.add_role(individual, a_prop, placeholder_individual)
+        self.instrumentation.count('axioms_added')
         self._placeholder_count = self._placeholder_count+1
         
-        # the changed KB has to be saved and read again
-        # because of an unfixed issue in owlapy
-        if (os.path.exists('file:/temporary_kb_storage.owl')):
-            os.remove('file:/temporary_kb_storage.owl')
-        self._manager_editing.save_ontology(
-            onto, IRI.create('file:/temporary_kb_storage.owl'))
-        data_file_new = os.path.join(os.getcwd(), 'temporary_kb_storage.owl')
-        
-        if holds:
-            # for method "negative"
-            self._make_hold(data_file_new, a_filler, placeholder_individual)
-        else:
-            # for method "positive"
-            self._make_hold(data_file_new, OWLObjectComplementOf(a_filler), placeholder_individual)
+        # the placeholder and r(x, y) are applied to the base ontology in
+        # memory for the recursion, so the reasoner sees them without
+        # saving and reloading the KB
+        with overlay.applied(reasoner):
+            if holds:
+                # for method "negative"
+                self._hold(overlay, a_filler, placeholder_individual,
+                           reasoner)
+            else:
+                # for method "positive"
+                self._hold(overlay,
+                           NNF().get_class_nnf(OWLObjectComplementOf(a_filler)),
+                           placeholder_individual, reasoner)
             
-    def check_protection(kb, concept, individual):
-        if self.protected != None:
-            if isinstance(concept_part, OWLObjectComplementOf):
-                check_if_protected = concept_part.get_operand()
+    def _simplify(self, sub_lists):
+        '''
+        Removes the terms/clauses that can not lead to another candidate:
+        duplicates, terms/clauses with a literal and its complement (an
+        unsatisfiable term, a tautological clause) and, by absorption,
+        terms that are subsumed by another term and clauses that subsume
+        another clause.
+        '''
+        kept = []
+        for sub_list in sub_lists:
+            literals = list(OrderedDict.fromkeys(sub_list))
+            if any(_normal_forms.get('nnf', OWLObjectComplementOf(literal))
+                   in literals for literal in literals):
+                continue
+            kept.append(literals)
+        # a term T1 with T1 ⊑ T2 is absorbed by T2, since every literal of
+        # T2 subsumes a literal of T1; for clauses C1 ⊑ C2 absorbs C2
+        def absorbs(a_list, other):
+            if self._goal_is_hold:
+                return all(any(self._reasoner.is_subsumed(literal, literal_2)
+                               for literal in other)
+                           for literal_2 in a_list)
+            return all(any(self._reasoner.is_subsumed(literal, literal_2)
+                           for literal_2 in other)
+                       for literal in a_list)
+        simplified = []
+        for index, sub_list in enumerate(kept):
+            # of two equivalent terms/clauses the first one is kept
+            if not any(absorbs(other, sub_list)
+                       and (other_index < index
+                            or not absorbs(sub_list, other))
+                       for other_index, other in enumerate(kept)
+                       if other_index != index):
+                simplified.append(sub_list)
+        if len(simplified) < len(sub_lists):
+            self.instrumentation.event('simplified',
+                                       removed=len(sub_lists)-len(simplified))
+        return simplified
+
+    def _compile_protection(self, protect_sub_features):
+        '''
+        Compiles the protected features into sets of IRIs, optionally
+        closed under the class and role hierarchy.
+        '''
+        self._protected_classes = set()
+        self._protected_roles = set()
+        for feature in self.protected or []:
+            if isinstance(feature, OWLClass):
+                features = [feature]
+                if protect_sub_features:
+                    features.extend(self._reasoner.sub_classes(feature))
+                self._protected_classes.update(
+                    a_class.get_iri().as_str() for a_class in features)
+            elif isinstance(feature, OWLObjectProperty):
+                features = [feature]
+                if protect_sub_features:
+                    features.extend(
+                        self._reasoner.sub_object_properties(feature))
+                self._protected_roles.update(
+                    role.get_iri().as_str() for role in features)
+        self._protected_classes = frozenset(self._protected_classes)
+        self._protected_roles = frozenset(self._protected_roles)
+
+    def _answer(self, concept_part):
+        '''
+        C(x) for a literal of a term/clause on the base ontology, evaluated
+        once per run and shared by all terms/clauses.
+        '''
+        if concept_part not in self._answers:
+            self._answers[concept_part] = self.is_instance(self._individual,
+                                                           concept_part)
+        return self._answers[concept_part]
+
+    def _classify(self, sub_lists):
+        '''
+        Sorts the terms/clauses into trivially satisfied (no literal has to
+        be changed), impossible (a literal that has to be changed is
+        protected, or is ⊥ in a term or ⊤ in a clause) and needing edits.
+        Returns the terms/clauses that are not impossible; the trivially
+        satisfied ones are remembered, they need no KB copy.
+        '''
+        self._answers = {}
+        self._satisfied = set()
+        self._base_holds = None
+        kept = []
+        for sub_list in sub_lists:
+            to_change = [concept_part for concept_part in sub_list
+                         if self._answer(concept_part) != self._goal_is_hold]
+            if not to_change:
+                self._satisfied.add(tuple(sub_list))
+            elif any(self.check_protection(concept_part, verbose = False)
+                     or (concept_part.is_owl_nothing() if self._goal_is_hold
+                         else concept_part.is_owl_thing())
+                     for concept_part in to_change):
+                continue
+            kept.append(sub_list)
+        self.instrumentation.event(
+            'classified', satisfied=len(self._satisfied),
+            impossible=len(sub_lists)-len(kept),
+            needs_edits=len(kept)-len(self._satisfied))
+        return kept
+
+    def check_protection(self, concept, verbose: bool = True):
+        if self._protected_classes or self._protected_roles:
+            if isinstance(concept, OWLObjectComplementOf):
+                check_if_protected = concept.get_operand()
             else:
-                check_if_protected = concept_part
+                check_if_protected = concept
             if isinstance(check_if_protected, OWLClass):
-                if check_if_protected in self.protected:
-                    print("protected feature must not be changed.")           
+                if check_if_protected.get_iri().as_str() \
+                in self._protected_classes:
+                    if verbose:
+                        self.instrumentation.event(
+                            'protected', feature=str(check_if_protected),
+                            reason="protected feature must not be changed.")
                     return True
             elif isinstance(check_if_protected, 
                           OWLObjectSomeValuesFrom)\
             or isinstance(check_if_protected, 
                           OWLObjectAllValuesFrom):
-                if check_if_protected.get_property()\
-                in self.protected:          
-                    print("protected property must not be changed.")           
+                if check_if_protected.get_property().get_iri().as_str() \
+                in self._protected_roles:
+                    if verbose:
+                        self.instrumentation.event(
+                            'protected',
+                            feature=str(check_if_protected.get_property()),
+                            reason="protected property must not be changed.")
                     return True
+        return False
+
+    def _cancelled(self):
+        return self._cancel is not None and self._cancel.is_set()
+
+    def iter_candidates(self, workers: int = 1, best_first: bool = False,
+                        limit: int = None, cancel=None):
+        '''
+        Yields a CounterfactualCandidate for every term of the TLDNF
+        (goal_is_hold) or clause of the TLCNF (not goal_is_hold) as soon as
+        it is verified, so consumers can stop early. Only the delta of a
+        candidate is kept, its full ontology is materialized on demand.
+        Args:
+            workers: number of processes the terms/clauses are spread over.
+                The workers inherit the loaded ontology by fork, the
+                results are yielded in the order of the terms/clauses.
+            best_first: set True to yield the candidates in order of the
+                number of changed assertions of the individual (best-first
+                search with branch and bound, runs in this process)
+            limit: maximal number of candidates to yield
+            cancel: optional threading.Event, once it is set no further
+                term/clause is started
+        '''
+        if workers > 1 and self._snapshot is not None:
+            raise ValueError("workers > 1 can not be used with snapshot, "
+                             "the workers would share its SQLite file.")
+        self._kb_count = 0
+        self._cancel = cancel
+        # the normal form only depends on the concept, so it is kept
+        # for further runs (e.g. in generate_batch)
+        if self._concept_as_list is None:
+            with self.instrumentation.phase('normalization'):
+                self._concept_as_list = self._simplify(
+                    [sub_list if type(sub_list) == list else [sub_list]
+                     for sub_list in self._create_list()])
+        with self.instrumentation.phase('index_build'):
+            self._index = _NeighbourhoodIndex(
+                self._reasoner, self._individual, self._concept)
+        self._run_list = self._classify(self._concept_as_list)
+        
+        if best_first:
+            search = self._iter_best_first(limit)
+            candidates = search
+        else:
+            search = self._iter_in_order(workers)
+            candidates = itertools.islice(search, limit)
+
+        if self._saving and self._save_format == 'changes':
+            os.makedirs(self._output_dir, exist_ok=True)
+            self.change_set_file = os.path.join(
+                self._output_dir,
+                f'{self._candidate_prefix}Candidates_{self._run_id()}.jsonl')
+            self._change_set = ChangeSetWriter(self.change_set_file,
+                                               self._data_file)
+        try:
+            yield from candidates
+            self.instrumentation.event('run_cancelled' if self._cancelled()
+                                       else 'run_finished',
+                                       individual=str(self._individual),
+                                       candidates=self._kb_count,
+                                       **self.instrumentation.report())
+        finally:
+            # shuts down a worker pool if the consumer stopped early
+            search.close()
+            self._cancel = None
+            if self._change_set is not None:
+                self._change_set.close()
+                self._change_set = None
+
+    def _run_id(self):
+
+        run = json.dumps([self._individual.get_iri().as_str(),
+                          repr(self._concept), self._goal_is_hold])
+        return hashlib.sha256(run.encode('utf-8')).hexdigest()[:16]
+
+    def _iter_in_order(self, workers):
+
+        # "for term in CC do" / "for clause in CC do"
+        if workers > 1:
+            import multiprocessing
+            global _worker_generator
+            _worker_generator = self
+            try:
+                pool = multiprocessing.get_context('fork').Pool(workers)
+            finally:
+                _worker_generator = None
+            with pool:
+                results = pool.imap(_candidate_worker,
+                                    range(len(self._run_list)))
+                for sub_list, (result, report) in zip(self._run_list,
+                                                      results):
+                    if self._cancelled():
+                        break
+                    self.instrumentation.take_candidate_timings()
+                    self.instrumentation.merge(report['timers'],
+                                               report['counters'])
+                    if result is not None:
+                        yield self._new_candidate(
+                            _OntologyOverlay.from_tuples(self.onto, *result),
+                            sub_list)
+        else:
+            for index, sub_list in enumerate(self._run_list):
+                if self._cancelled():
+                    break
+                overlay = self._make_candidate(index)
+                if overlay is not None:
+                    yield self._new_candidate(overlay, sub_list)
+
+    def generate_candidates(self, workers: int = 1):
+        '''
+        Creates all candidates (see iter_candidates) and collects them in
+        candidate_dict and kb_dict.
+        '''
+        self.candidate_dict = {}
+        self.kb_dict = {}
+        for candidate in self.iter_candidates(workers=workers):
+            self.kb_dict[str(candidate.concept_part)] = candidate
+            self.candidate_dict[candidate.name] = {
+                "concept_part": str(candidate.concept_part)}
+
+    def generate_batch(self, individuals, workers: int = 1):
+        '''
+        Creates the candidates for many individuals with the ontology,
+        reasoner and normal form of the concept that are already loaded.
+        Yields (individual, candidate_dict, kb_dict) per individual.
+        Saved candidates are prefixed with the name of the individual.
+        Not possible with extract_module, the module depends on the
+        individual.
+        '''
+        if self._extract_module:
+            raise ValueError("generate_batch can not be used with "
+                             "extract_module=True.")
+        for individual in individuals:
+            self._individual = individual
+            self._candidate_prefix = f'{individual.get_iri().get_remainder()}_'
+            try:
+                self.generate_candidates(workers=workers)
+            finally:
+                self._candidate_prefix = ''
+            yield individual, self.candidate_dict, self.kb_dict
+
+
+class AsyncCandidateService:
+    '''
+    asyncio facade for serving candidates, e.g. from a web service.
+    Every ontology is loaded once into a generator that stays warm and is
+    shared by all requests for it, its runs are serialized since they
+    apply their changes to the shared ontology. Runs go to a thread pool,
+    so the event loop is not blocked.
+    Args:
+        max_concurrent: maximal number of runs at the same time
+        timeout: default timeout of a request in seconds, None for no
+            timeout
+        executor: optional concurrent.futures executor for the runs
+    '''
+
+    __slots__ = '_semaphore', '_timeout', '_executor', '_generators', \
+        '_locks'
+
+    def __init__(self, max_concurrent: int = 4, timeout: float = None,
+                 executor=None):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._timeout = timeout
+        self._executor = executor if executor is not None \
+            else ThreadPoolExecutor(max_concurrent)
+        self._generators = {}
+        self._locks = {}
+
+    async def preload(self, data_file, namespace: str):
+        '''
+        Loads the ontology and builds its reasoner, requests for the same
+        ontology wait for the same load.
+        '''
+        import asyncio
+        key = (os.path.abspath(data_file), namespace)
+        if key not in self._generators:
+            loop = asyncio.get_running_loop()
+            self._locks.setdefault(key, asyncio.Lock())
+            self._generators[key] = loop.run_in_executor(
+                self._executor, lambda: CounterfactualCandidateGenerator(
+                    OWLThing, data_file, None, namespace, saving=False))
+        try:
+            return await asyncio.shield(self._generators[key])
+        except Exception:
+            # a failed load is retried by the next request
+            self._generators.pop(key, None)
+            raise
+
+    async def explain(self, concept, data_file, individual, namespace: str,
+                      goal_is_hold: bool = True, protected: list = None,
+                      timeout: float = None):
+        '''
+        Creates the candidates of an individual as change set entries (see
+        read_change_set) by name. On timeout or cancellation the run
+        stops before its next term/clause and asyncio.TimeoutError or
+        asyncio.CancelledError is raised.
+        Args:
+            timeout: timeout of this request in seconds, defaults to the
+                timeout of the service
+        '''
+        import asyncio
+        return await asyncio.wait_for(
+            self._explain(concept, data_file, individual, namespace,
+                          goal_is_hold, protected),
+            timeout if timeout is not None else self._timeout)
+
+    async def _explain(self, concept, data_file, individual, namespace,
+                       goal_is_hold, protected):
+
+        import asyncio
+        generator = await self.preload(data_file, namespace)
+        async with self._locks[(os.path.abspath(data_file), namespace)]:
+            async with self._semaphore:
+                cancel = threading.Event()
+                run = asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._run, generator, cancel, concept,
+                    individual, goal_is_hold, protected)
+                try:
+                    return await asyncio.shield(run)
+                except asyncio.CancelledError:
+                    cancel.set()
+                    # the shared ontology is only free again after the run
+                    await asyncio.wait([run])
+                    raise
+
+    @staticmethod
+    def _run(generator, cancel, concept, individual, goal_is_hold,
+             protected):
+
+        generator.set_concept(concept, goal_is_hold, protected,
+                              individual=individual)
+        return OrderedDict((candidate.name, _change_entry(candidate))
+                           for candidate
+                           in generator.iter_candidates(cancel=cancel))
+
+    def close(self):
+        '''
+        Waits for the running runs and closes the warm generators (see
+        CounterfactualCandidateGenerator.close), the service can not be
+        used afterwards.
+        '''
+        self._executor.shutdown(wait=True)
+        for load in self._generators.values():
+            if load.done():
+                self._close_generator(load)
             else:
-                return False   
+                load.add_done_callback(self._close_generator)
+        self._generators = {}
+
+    @staticmethod
+    def _close_generator(load):
+
+        if not load.cancelled() and load.exception() is None:
+            load.result().close()
          
         
 '''       
@@ -531,17 +2330,3 @@ class CounterfactualCandidateGenerator:
    
 '''            
             
-    def generate_candidates(self):
-
-        kb_count = 0
-        self._concept_as_list = self._create_list()
-        self.candidate_dict = {}
-        self.kb_dict = {}
-        
-        if self._goal_is_hold:            
-            self._make_hold(self._data_file, self._concept_as_list, self._individual, self.kb_dict, self.protected)
-        
-
-        
-
-        
\ No newline at end of file
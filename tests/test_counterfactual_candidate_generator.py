@@ -0,0 +1,274 @@
+import os
+import shutil
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('owlapy.model')
+
+from owlapy.model import IRI, OWLClass, OWLNamedIndividual, \
+    OWLObjectComplementOf, OWLObjectProperty
+import counterfactual_candidate_generator_ALC as generator_module
+
+NAMESPACE = 'http://example.com/smoke#'
+
+
+def _write_ontology(file_name):
+    '''
+    A and B are classes, x is an instance of B only.
+    '''
+    owlready2 = pytest.importorskip('owlready2')
+    world = owlready2.World()
+    onto = world.get_ontology(NAMESPACE)
+    with onto:
+        types.new_class('A', (owlready2.Thing,))
+        b_class = types.new_class('B', (owlready2.Thing,))
+        b_class('x')
+    onto.save(file=file_name, format='rdfxml')
+
+
+def _overlay():
+    '''
+    An overlay of a base ontology that is never applied.
+    '''
+    base = types.SimpleNamespace(get_owl_ontology_manager=lambda: None)
+    return generator_module._OntologyOverlay(base)
+
+
+def test_overlay_add_and_remove_cancel():
+    x = OWLNamedIndividual(IRI(NAMESPACE, 'x'))
+    y = OWLNamedIndividual(IRI(NAMESPACE, 'y'))
+    class_record = generator_module._class_record(
+        x, OWLClass(IRI(NAMESPACE, 'A')))
+    role_record = generator_module._role_record(
+        x, OWLObjectProperty(IRI(NAMESPACE, 'r')), y)
+    overlay = _overlay()
+    overlay.add(class_record)
+    overlay.remove(role_record)
+    changes = ([('class', f'{NAMESPACE}x', f'{NAMESPACE}A')],
+               [('role', f'{NAMESPACE}x', f'{NAMESPACE}r', f'{NAMESPACE}y')])
+    assert overlay.to_tuples() == changes
+    assert overlay.cost(x) == 2
+    assert overlay.cost(y) == 0
+    assert generator_module._OntologyOverlay.from_tuples(
+        overlay._base, *changes).to_tuples() == changes
+
+    # removing an added assertion and adding a removed one undo the edits
+    overlay.remove(class_record)
+    overlay.add(role_record)
+    assert len(overlay) == 0
+    assert overlay.to_tuples() == ([], [])
+
+
+def _generator(**attributes):
+    '''
+    A generator without ontology, for the parts that need none.
+    '''
+    generator = object.__new__(
+        generator_module.CounterfactualCandidateGenerator)
+    generator.instrumentation = generator_module.Instrumentation()
+    generator._cancel = None
+    generator._individual = None
+    generator.__dict__.update(attributes)
+    return generator
+
+
+class _CostOverlay:
+
+    def __init__(self, cost):
+        self._cost = cost
+
+    def cost(self, individual):
+        return self._cost
+
+
+def test_change_set_round_trip(tmp_path):
+    data_file = tmp_path / 'base.owl'
+    data_file.write_text('<rdf:RDF/>')
+    overlay = _overlay()
+    overlay.add(generator_module._class_record(
+        OWLNamedIndividual(IRI(NAMESPACE, 'x')),
+        OWLClass(IRI(NAMESPACE, 'A'))))
+    candidate = generator_module.CounterfactualCandidate(
+        'Candidate0', [OWLClass(IRI(NAMESPACE, 'A'))], overlay, 1)
+    file_name = str(tmp_path / 'Candidates.jsonl')
+    with generator_module.ChangeSetWriter(file_name,
+                                          str(data_file)) as change_set:
+        change_set.write(candidate)
+
+    header, candidates = generator_module.read_change_set(file_name)
+    assert header['base'] == str(data_file)
+    assert list(candidates) == ['Candidate0']
+    assert candidates['Candidate0']['cost'] == 1
+    assert candidates['Candidate0']['added'] == [
+        ['class', f'{NAMESPACE}x', f'{NAMESPACE}A']]
+    assert candidates['Candidate0']['removed'] == []
+
+    data_file.write_text('<rdf:RDF></rdf:RDF>')
+    with pytest.raises(ValueError, match='was changed'):
+        generator_module.load_candidate(file_name, 'Candidate0')
+
+
+def test_runs_have_own_change_set_files():
+    x = OWLNamedIndividual(IRI(NAMESPACE, 'x'))
+    y = OWLNamedIndividual(IRI(NAMESPACE, 'y'))
+    a_class = OWLClass(IRI(NAMESPACE, 'A'))
+    run_ids = {_generator(_individual=individual, _concept=a_class,
+                          _goal_is_hold=goal_is_hold)._run_id()
+               for individual in (x, y) for goal_is_hold in (True, False)}
+    assert len(run_ids) == 4
+    assert _generator(_individual=x, _concept=a_class,
+                      _goal_is_hold=True)._run_id() in run_ids
+
+
+def test_normal_form_store_keeps_equal_concepts(tmp_path):
+    concept = OWLObjectComplementOf(OWLClass(IRI(NAMESPACE, 'A')))
+    store = generator_module._NormalFormStore(
+        str(tmp_path / 'forms.sqlite'))
+    try:
+        store.put('nnf', concept)
+        assert store.get('nnf') == concept
+        assert store.get('tldnf') is None
+    finally:
+        store.close()
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(generator_module.time, 'time', lambda: next(clock))
+    entries = [{'name': 'Candidate0', 'added': [], 'removed': []}]
+    with generator_module.ResultCache(str(tmp_path / 'results.sqlite'),
+                                      max_entries=2) as cache:
+        cache.put('a', entries)
+        cache.put('b', entries)
+        assert cache.get('a') == {'Candidate0': entries[0]}
+        cache.put('c', entries)
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.get('c') is not None
+
+
+def test_result_cache_key(tmp_path):
+    data_file = tmp_path / 'base.owl'
+    data_file.write_text('<rdf:RDF/>')
+    a_class = OWLClass(IRI(NAMESPACE, 'A'))
+    x = OWLNamedIndividual(IRI(NAMESPACE, 'x'))
+    key = generator_module.ResultCache.key(str(data_file), a_class, x,
+                                           NAMESPACE)
+    assert generator_module.ResultCache.key(
+        str(data_file), a_class, x, NAMESPACE) == key
+    assert generator_module.ResultCache.key(
+        str(data_file), a_class, x, 'http://example.com/other#') != key
+    assert generator_module.ResultCache.key(
+        str(data_file), a_class, x, NAMESPACE, goal_is_hold=False) != key
+    data_file.write_text('<rdf:RDF></rdf:RDF>')
+    assert generator_module.ResultCache.key(
+        str(data_file), a_class, x, NAMESPACE) != key
+
+
+class _Hierarchy:
+    '''
+    is_subsumed of a reasoner on a told class hierarchy.
+    '''
+
+    def __init__(self, subsumptions):
+        self._subsumptions = subsumptions
+
+    def is_subsumed(self, sub, sup):
+        return sub == sup or (sub, sup) in self._subsumptions
+
+
+def test_simplify_terms():
+    a_class, b_class, c_class = (OWLClass(IRI(NAMESPACE, name))
+                                 for name in 'ABC')
+    not_a = OWLObjectComplementOf(a_class)
+    generator = _generator(_goal_is_hold=True,
+                           _reasoner=_Hierarchy({(c_class, b_class)}))
+    # A ⊓ ¬A is unsatisfiable, A ⊓ B and B ⊓ A are absorbed by A, C by B
+    assert generator._simplify([[a_class, not_a], [a_class, b_class],
+                                [a_class], [b_class, a_class, a_class],
+                                [c_class], [b_class]]) == \
+        [[a_class], [b_class]]
+
+
+def test_simplify_clauses():
+    a_class, b_class, c_class = (OWLClass(IRI(NAMESPACE, name))
+                                 for name in 'ABC')
+    not_a = OWLObjectComplementOf(a_class)
+    generator = _generator(_goal_is_hold=False,
+                           _reasoner=_Hierarchy({(c_class, b_class)}))
+    # A ⊔ ¬A is a tautology, A ⊔ B is absorbed by A, B by C; of the
+    # equivalent clauses A and A ⊔ A the first one is kept
+    assert generator._simplify([[a_class, not_a], [a_class, b_class],
+                                [a_class], [a_class, a_class], [b_class],
+                                [c_class]]) == [[a_class], [c_class]]
+
+
+def test_lower_bound_counts_one_edit():
+    a_class, b_class, c_class = (OWLClass(IRI(NAMESPACE, name))
+                                 for name in 'ABC')
+    generator = _generator(
+        _goal_is_hold=True,
+        _answers={a_class: False, b_class: False, c_class: True},
+        _protected_classes=set(), _protected_roles=set())
+    # one edit can make both A and B hold, e.g. adding A(x) for A ⊑ B
+    assert generator._lower_bound([a_class, b_class]) == 1
+    assert generator._lower_bound([a_class, c_class]) == 1
+    assert generator._lower_bound([c_class]) == 0
+
+
+def test_best_first_yields_by_cost_and_bounds_branches():
+    bounds = [0, 0, 1, 3]
+    costs = [1, 2, 5, 9]
+    built = []
+
+    def make_candidate(index, max_cost=float('inf')):
+        built.append((index, max_cost))
+        if costs[index] > max_cost:
+            return None
+        return _CostOverlay(costs[index])
+
+    generator = _generator(
+        _run_list=[[index] for index in range(len(costs))],
+        _lower_bound=lambda sub_list: bounds[sub_list[0]],
+        _make_candidate=make_candidate,
+        _new_candidate=lambda overlay, sub_list, timings: (
+            sub_list[0], overlay.cost(None)))
+
+    assert list(generator._iter_best_first(None)) == [
+        (0, 1), (1, 2), (2, 5), (3, 9)]
+    built.clear()
+    # the third term is bounded by the second cheapest candidate, the
+    # fourth one is never built
+    assert list(generator._iter_best_first(2)) == [(0, 1), (1, 2)]
+    assert built == [(0, float('inf')), (1, float('inf')), (2, 2)]
+
+
+def test_event_data_may_contain_name():
+    events = []
+    instrumentation = generator_module.Instrumentation(
+        lambda event, data: events.append((event, data)))
+    instrumentation.event('candidate_created', name='Candidate0')
+    assert events == [('candidate_created', {'name': 'Candidate0'})]
+
+
+def test_generate_single_candidate(tmp_path):
+    pytest.importorskip('ontolearn.knowledge_base')
+    if shutil.which('java') is None:
+        pytest.skip('the reasoner needs java')
+    file_name = str(tmp_path / 'smoke.owl')
+    _write_ontology(file_name)
+    events = []
+    generator = generator_module.CounterfactualCandidateGenerator(
+        OWLClass(IRI(NAMESPACE, 'A')), file_name,
+        OWLNamedIndividual(IRI(NAMESPACE, 'x')), NAMESPACE, saving=False,
+        on_event=lambda event, data: events.append(event))
+    generator.generate_candidates()
+
+    assert list(generator.candidate_dict) == ['Candidate0']
+    candidate = next(iter(generator.kb_dict.values()))
+    assert candidate.changes() == (
+        [('class', f'{NAMESPACE}x', f'{NAMESPACE}A')], [])
+    assert 'candidate_created' in events